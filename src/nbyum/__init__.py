@@ -1,65 +1,255 @@
 import logging
+import os
+import shlex
+import sys
+import time
 
-from .logging_hijack import (NBYumLogger, NBYumTextMeter,
-                             PROGRESS_LEVEL, RECAP_LEVEL)
-from .utils import (DummyOpts, timestamp_to_pretty_local_datetime,
+from . import fastpath
+from .errors import NBYumException, ParserExit
+from .journal import aggregate, append_entry, read_entries
+from .metrics import (enable_timings, flush_trace, span, stage, start_record,
+                      start_trace, stop_record)
+from .output import NBYumEmitter, NBYumRecorder, get_emitter, set_emitter
+from .utils import (DummyOpts, NBYumArgumentParser, get_parser,
+                    timestamp_to_pretty_local_datetime,
                     timestamp_to_iso_local_datetime, locked)
-from .yumbase import NBYumBase
 
 
 class NBYumCli(object):
+    # What each command needs loaded before it runs, among the resources
+    # NBYumBase.prepare() knows about. Anything else is loaded on first use.
+    # check_update prepares itself, as it usually doesn't need anything.
+    command_needs = {"commit": ("sacks", "updateinfo"),
+                     "info": ("sacks", ),
+                     "install": ("sacks", ),
+                     "list": ("catalog", ),
+                     "remove": ("sacks", ),
+                     "update": ("sacks", "updateinfo"),
+                     }
+
+    # Commands after which our Yum base can't be reused
+    mutating_commands = ("commit", "install", "rebuild_cache", "refresh",
+                         "remove", "update")
+
+    # What the plugins expect from the command line of mutating commands
+    plugin_options = {"install": {"nuke_newsave": True,
+                                  "posttrans_triggers": True},
+                      "remove": {"remove_leaves": True,
+                                 "posttrans_triggers": True},
+                      "update": {"nuke_newsave": True,
+                                 "posttrans_triggers": True},
+                      }
+
+    # Plugins which only act on transactions, so that only the commands
+    # modifying the system need to load them
+    transaction_plugins = ("nuke-newsave", "posttrans-triggers")
+
+    # Commands which serve other commands
+    serving_commands = ("batch", "serve")
+
     def __init__(self, args):
         self.args = args
 
+        # -- Set up our output ----------------------------------------------
+        self.emitter_options = {"flush_policy": self.args.flush,
+                                "progress_window": self.args.coalesce_progress,
+                                }
+        set_emitter(NBYumEmitter(**self.emitter_options))
+        enable_timings(self.args.timings)
+
+        if self.args.trace:
+            start_trace(self.args.trace, profile=self.args.trace_profile)
+
+        # Set up on first use, as some commands can do without it
+        self.__base = None
+
+        # When the package metadata was loaded
+        self.prepared_at = None
+
+    @property
+    def base(self):
+        if self.__base is None:
+            self.__base = self.__setup_base()
+
+        return self.__base
+
+    def __setup_base(self):
+        """Set up a new Yum base according to the global options."""
+        # Importing Yum is expensive, only do it when we need it
+        from .logging_hijack import (NBYumDownloadProgress, NBYumLogger,
+                                     NBYumMultiFileMeter, NBYumTextMeter,
+                                     PROGRESS_LEVEL, RECAP_LEVEL)
+
         # -- Hijack the Yum logging ------------------------------------------
         logging.setLoggerClass(NBYumLogger)
         logging.addLevelName(PROGRESS_LEVEL, "progress")
         logging.addLevelName(RECAP_LEVEL, "recap")
 
-        self.base = NBYumBase()
+        from .yumbase import NBYumBase
+
+        base = NBYumBase()
 
         # -- Deal with the preconfig stuff -----------------------------------
-        if not args.debug:
-            self.base.preconf.debuglevel = 0
+        if not self.args.debug:
+            base.preconf.debuglevel = 0
         else:
-            self.base.preconf.debuglevel = 6
+            base.preconf.debuglevel = 6
 
-        if args.config:
-            self.base.preconf.fn = args.config
+        if self.args.config:
+            base.preconf.fn = self.args.config
 
-        self.base.prerepoconf.progressbar = NBYumTextMeter()
+        if self.args.func not in self.mutating_commands + \
+                                 self.serving_commands:
+            # Loading plugins is expensive, skip those we won't need
+            base.preconf.disabled_plugins = list(self.transaction_plugins)
+
+        download_progress = NBYumDownloadProgress()
+        base.download_progress = download_progress
+        base.prerepoconf.progressbar = NBYumTextMeter(download_progress)
+        base.prerepoconf.multi_progressbar = \
+                NBYumMultiFileMeter(download_progress)
 
         # This sets up a bunch of stuff
-        self.base.conf
+        base.conf
+
+        if self.args.download_workers:
+            # Repositories inherit it, as long as they weren't read yet. This
+            # has no effect with Yum versions which can't download packages
+            # concurrently.
+            base.conf.max_connections = self.args.download_workers
 
         if self.args.func == "last_updated":
-            args.force_cache = True
+            self.args.force_cache = True
 
-        if args.force_cache:
+        if self.args.force_cache:
             if self.args.func == "rebuild_cache":
-                self.base.logger.warning("Ignoring --force-cache argument, as"
-                                         " we are rebuilding the cache")
+                base.logger.warning("Ignoring --force-cache argument, as"
+                                    " we are rebuilding the cache")
+
+            elif self.args.func == "refresh":
+                base.logger.warning("Ignoring --force-cache argument, as"
+                                    " we are refreshing the cache")
 
             else:
-                self.base.conf.cache = 1
+                base.conf.cache = 1
+
+        elif self.args.max_cache_age and \
+             self.args.func not in self.mutating_commands and \
+             base.is_metadata_fresh(self.args.max_cache_age):
+            # Leave the metadata downloads to `nbyum refresh'
+            base.conf.cache = 1
+
+        return base
+
+    def reset(self):
+        """Throw away our Yum base, a fresh one is set up on next use."""
+        if self.__base is not None:
+            self.__base.close()
+            self.__base = None
+
+        self.prepared_at = None
+
+    def __get_needs(self):
+        """Get what the requested command needs loaded before it runs."""
+        if self.args.func == "list" and self.args.filter == "installed":
+            # Installed packages don't need any repository metadata
+            return ()
+
+        return self.command_needs.get(self.args.func, ())
 
     @locked
-    def prepare(self):
-        self.base.prepare()
-        self.base.logger.log_progress({"current": 0, "total": 1,
-                                       "hint": "Processing the package "
-                                               "metadata..."})
+    def prepare(self, needs):
+        self.__prepare(needs)
+
+    def __prepare(self, needs):
+        with stage("prepare"):
+            self.base.prepare(needs)
+            self.base.logger.log_progress({"current": 0, "total": 1,
+                                           "hint": "Processing the package "
+                                                   "metadata..."})
+        self.prepared_at = time.time()
 
     def run(self):
+        if self.args.func == "stats":
+            # Its own runs would only skew the statistics
+            return self.__run()
+
+        start_record()
+        started = time.time()
+        exit_code = 1
+
+        try:
+            with span("run", command=self.args.func):
+                exit_code = self.__run()
+
+            return exit_code
+
+        finally:
+            self.__journal(time.time() - started, exit_code, stop_record())
+
+    def __get_journal_path(self, setup_base=False):
+        """Get the path of our journal.
+
+        Unless `setup_base` is True, return None if we can't know it without
+        setting Yum up.
+        """
+        paths = None
+
+        if self.__base is None:
+            paths = fastpath.get_paths(self.args.config)
+
+        if paths is not None:
+            unused, persistdir = paths
+
+        elif self.__base is not None or setup_base:
+            persistdir = self.base.conf.persistdir
+
+        else:
+            return None
+
+        return os.path.join(persistdir, "nbyum", "journal.jsonl")
+
+    def __journal(self, duration, exit_code, record):
+        """Record an invocation in our journal."""
+        args = dict([(k, v) for k, v in vars(self.args).items()
+                     if k != "func"])
+
+        stages = dict([(name, round(seconds, 3))
+                       for name, seconds in record["stages"].items()])
+
+        entry = {"time": time.time(), "command": self.args.func,
+                 "args": args, "exit_code": exit_code,
+                 "duration": round(duration, 3), "stages": stages,
+                 "counters": record["counters"]}
+
         try:
+            path = self.__get_journal_path()
+
+            if path is not None:
+                append_entry(path, entry)
+
+        except (IOError, OSError), e:
+            # The journal is nice to have, it must not break the command
+            if self.__base is not None:
+                self.__base.verbose_logger.debug("Could not write the "
+                                                 "journal: %s" % e)
+
+    def __run(self):
+        try:
+            # -- Answer without Yum if we can --------------------------------
+            if self.__base is None and not self.args.debug and \
+               fastpath.run(self.args):
+                return 0
+
             # -- Prepare our Yum base for the user's request -----------------
-            if self.args.func not in ("last_updated", "rebuild_cache"):
-                self.prepare()
+            needs = self.__get_needs()
+
+            if needs and self.prepared_at is None:
+                self.prepare(needs)
 
             # -- Then do what we were asked ----------------------------------
             func = getattr(self, self.args.func)
-            func()
-            return 0
+            return func() or 0
 
         except Exception, e:
             if self.args.debug:
@@ -69,33 +259,161 @@ class NBYumCli(object):
             self.base.logger.error(e)
             return 1
 
+        finally:
+            get_emitter().flush()
+
+    def run_subcommand(self, argv):
+        """Run a subcommand against our already prepared Yum base.
+
+        This allows serving several commands from a single process, loading
+        the package metadata only once.
+        """
+        try:
+            args = get_parser(NBYumArgumentParser).parse_args(argv)
+
+        except ParserExit, e:
+            # e.g --help, which was already printed
+            if e.message:
+                self.base.logger.error(e.message)
+
+            return e.status
+
+        except NBYumException, e:
+            self.base.logger.error(e)
+            return 2
+
+        if args.func in self.serving_commands:
+            self.base.logger.error("Can not run '%s' from here" % argv[0])
+            return 2
+
+        # The global options are the ones of the serving process
+        for option in ("debug", "config", "force_cache", "flush",
+                       "coalesce_progress", "download_workers", "timings",
+                       "trace", "trace_profile", "wait_lock",
+                       "max_cache_age"):
+            setattr(args, option, getattr(self.args, option))
+
+        # Make sure we see what happened since the previous command. This
+        # also sets our Yum base up with the options of the serving process,
+        # if it was reset.
+        self.base.closeRpmDB()
+
+        serving_args = self.args
+        self.args = args
+
+        try:
+            return self.run()
+
+        finally:
+            self.args = serving_args
+
+            if args.func in self.mutating_commands:
+                self.reset()
+
+            # We might be serving for a long time, don't keep the spans
+            flush_trace()
+
     # -- Functions corresponding to commands ---------------------------------
+    def batch(self):
+        """Run commands read from the standard input, one per line."""
+        failures = 0
+
+        for request_id, line in enumerate(iter(sys.stdin.readline, ""), 1):
+            emitter = NBYumEmitter(id=request_id, **self.emitter_options)
+            previous = set_emitter(emitter)
+
+            try:
+                try:
+                    argv = shlex.split(line, comments=True)
+
+                except ValueError, e:
+                    self.base.logger.error("Invalid command: %s" % e)
+                    exit_code = 2
+
+                else:
+                    if not argv:
+                        continue
+
+                    exit_code = self.run_subcommand(argv)
+
+                emitter.emit({"type": "exit", "code": exit_code})
+
+            finally:
+                emitter.flush()
+                set_emitter(previous)
+
+            if exit_code:
+                failures += 1
+
+        if failures:
+            return 1
+
     @locked
     def check_update(self):
-        """Check for updates to installed packages."""
-        last_update = self.base.get_last_updated()
+        """Check for updates to installed packages.
 
-        if last_update != None:
-            last_update = timestamp_to_pretty_local_datetime(last_update)
-            self.base.verbose_logger.info("Last updated on %s"
-                                          % last_update)
+        Nothing changed since the previous check, as long as neither the
+        installed packages nor the repositories did. In that case, we just
+        print the same output again.
+        """
+        key, output = self.base.get_cached_check_update(self.args.patterns)
+
+        if output is not None:
+            emitter = get_emitter()
 
-        self.base.update_packages(self.args.patterns, apply=False)
+            for obj in output:
+                emitter.emit(obj)
+
+            return
+
+        if self.prepared_at is None:
+            self.__prepare(("sacks", "updateinfo"))
+
+        recorder = NBYumRecorder(get_emitter())
+        previous = set_emitter(recorder)
+
+        try:
+            last_update = self.base.get_last_updated()
+
+            if last_update != None:
+                last_update = timestamp_to_pretty_local_datetime(last_update)
+                self.base.verbose_logger.info("Last updated on %s"
+                                              % last_update)
+
+            self.base.update_packages(self.args.patterns, apply=False)
+            self.base.recap_transaction()
+
+        finally:
+            set_emitter(previous)
+
+        if key is not None:
+            self.base.cache_check_update(key, recorder.recorded)
+
+    @locked
+    def commit(self):
+        """Apply a transaction saved as a plan."""
+        command = self.base.load_plan(self.args.token)
+        opts = DummyOpts(**self.plugin_options[command])
+        self.base.plugins.setCmdLine(opts, None)
+
+        self.base.commit_plan(self.args.token)
         self.base.recap_transaction()
 
     def info(self):
         """Get some infos about packages."""
-        self.base.get_infos(self.args.patterns)
+        self.base.get_infos(self.args.patterns, fields=self.args.fields,
+                            stream=self.args.stream)
 
     @locked
     def install(self):
         """Install packages and security modules."""
-        self.base.plugins.setCmdLine(DummyOpts(nuke_newsave=True,
-                                               posttrans_triggers=True),
-                                     None)
+        opts = DummyOpts(**self.plugin_options["install"])
+        self.base.plugins.setCmdLine(opts, None)
 
-        self.base.install_packages(self.args.type, self.args.patterns)
-        self.base.recap_transaction()
+        plan = self.base.install_packages(
+                self.args.type, self.args.patterns,
+                download_only=self.args.download_only, plan=self.args.plan)
+        self.base.recap_transaction(plan=plan)
 
     def last_updated(self):
         """Get the date of the last system update"""
@@ -108,30 +426,71 @@ class NBYumCli(object):
     def list(self):
         """List packages and security modules."""
         self.base.list_packages(self.args.type, self.args.filter,
-                                self.args.patterns, self.args.show_hidden)
+                                self.args.patterns, self.args.show_hidden,
+                                fields=self.args.fields,
+                                stream=self.args.stream)
 
     @locked
     def rebuild_cache(self):
         """Clean and rebuild the cache."""
         self.base.clean_cache()
-        self.base.prepare()
+        self.base.prepare(("sacks", "updateinfo", "catalog"))
+
+    def refresh(self):
+        """Refresh the package metadata, without getting in the way.
+
+        The metadata is downloaded without holding the Yum lock, which is
+        only taken to swap it in place.
+        """
+        # When serving, our Yum base already uses the live cache
+        self.reset()
+
+        dirs = self.base.stage_metadata()
+        self.__swap_metadata(dirs)
+
+        # Build the catalog of available packages right away, so that the
+        # next commands don't have to
+        self.reset()
+        self.base.conf.cache = 1
+        self.prepare(("catalog", ))
+
+    @locked
+    def __swap_metadata(self, dirs):
+        self.base.swap_metadata(dirs)
 
     @locked
     def remove(self):
         """Remove packages and security modules."""
-        self.base.plugins.setCmdLine(DummyOpts(remove_leaves=True,
-                                               posttrans_triggers=True),
-                                     None)
+        opts = DummyOpts(**self.plugin_options["remove"])
+        self.base.plugins.setCmdLine(opts, None)
 
-        self.base.remove_packages(self.args.type, self.args.patterns)
-        self.base.recap_transaction()
+        plan = self.base.remove_packages(self.args.type, self.args.patterns,
+                                         plan=self.args.plan)
+        self.base.recap_transaction(plan=plan)
+
+    def stats(self):
+        """Print statistics about the previous invocations."""
+        path = self.__get_journal_path(setup_base=True)
+
+        get_emitter().emit({"type": "recap",
+                            "stats": aggregate(read_entries(path))})
+
+    def serve(self):
+        """Serve requests on a Unix socket."""
+        self.prepare(("sacks", "updateinfo"))
+
+        from .server import NBYumServer
+
+        server = NBYumServer(self, self.args.socket, self.args.max_age)
+        server.serve_forever()
 
     @locked
     def update(self):
         """Actually update the whole system."""
-        self.base.plugins.setCmdLine(DummyOpts(nuke_newsave=True,
-                                               posttrans_triggers=True),
-                                     None)
+        opts = DummyOpts(**self.plugin_options["update"])
+        self.base.plugins.setCmdLine(opts, None)
 
-        self.base.update_packages(self.args.patterns, apply=True)
-        self.base.recap_transaction()
+        plan = self.base.update_packages(
+                self.args.patterns, apply=True,
+                download_only=self.args.download_only, plan=self.args.plan)
+        self.base.recap_transaction(plan=plan)
@@ -0,0 +1,342 @@
+import errno
+import json
+import mmap
+import os
+import struct
+
+
+# A catalog is a compact, memory-mappable file listing packages. It is made
+# of the following sections:
+#   - a header with a magic string, the format version, the length of the
+#     metadata and the number of packages;
+#   - the metadata, as a JSON object, with the key the catalog was built for
+#     and the names of the fields stored for each package;
+#   - a table with the offset of each package record;
+#   - the package records, sorted by name, with their fields separated by NUL
+#     bytes, ending with the offset and length of their description;
+#   - the descriptions, which are only read when actually needed.
+CATALOG_MAGIC = "NBYUMCAT"
+CATALOG_VERSION = 1
+
+_header = struct.Struct("<8sIII")
+_offset = struct.Struct("<I")
+
+# The fields we store for each package, besides its description
+CATALOG_FIELDS = ("name", "epoch", "version", "release", "arch", "group",
+                  "summary")
+
+
+def _to_str(value):
+    """Get a string we can store, whatever Yum gave us."""
+    if value is None:
+        return ""
+
+    if isinstance(value, unicode):
+        return value.encode("utf-8")
+
+    return str(value)
+
+
+class CatalogPackage(object):
+    """A package from a catalog.
+
+    It quacks enough like a Yum package object for our listings.
+    """
+    def __init__(self, catalog, fields, values):
+        self.__catalog = catalog
+
+        for field, value in zip(fields, values):
+            setattr(self, field, value)
+
+        self.__description = (int(values[-2]), int(values[-1]))
+
+    @property
+    def description(self):
+        return self.__catalog.read_description(*self.__description)
+
+    @property
+    def pkgtup(self):
+        return (self.name, self.arch, self.epoch, self.version, self.release)
+
+    def __str__(self):
+        if self.epoch != "0":
+            return "%s:%s-%s-%s.%s" % (self.epoch, self.name, self.version,
+                                       self.release, self.arch)
+
+        return "%s-%s-%s.%s" % (self.name, self.version, self.release,
+                                self.arch)
+
+
+class PackageCatalog(object):
+    """A read-only view on a catalog file."""
+    def __init__(self, path):
+        with open(path, "rb") as f:
+            self.__map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, meta_length, self.__count = \
+                _header.unpack_from(self.__map, 0)
+
+        if magic != CATALOG_MAGIC or version != CATALOG_VERSION:
+            raise ValueError("Not a catalog, or in an unsupported format")
+
+        meta_start = _header.size
+        meta = json.loads(self.__map[meta_start:meta_start+meta_length])
+
+        self.key = meta["key"]
+        self.fields = meta["fields"]
+
+        self.__offsets_start = meta_start + meta_length
+        self.__records_end = self.__get_offset(self.__count)
+
+    def __get_offset(self, index):
+        """Get the offset of a record, or the end of the records."""
+        return _offset.unpack_from(self.__map, self.__offsets_start +
+                                               index * _offset.size)[0]
+
+    def __get_values(self, index):
+        start = self.__get_offset(index)
+        end = self.__get_offset(index + 1)
+
+        return self.__map[start:end].split("\0")
+
+    def __get_name(self, index):
+        start = self.__get_offset(index)
+
+        return self.__map[start:self.__map.find("\0", start)]
+
+    def __bisect(self, name):
+        """Get the index of the first record with a name not before `name`."""
+        low, high = 0, self.__count
+
+        while low < high:
+            middle = (low + high) // 2
+
+            if self.__get_name(middle) < name:
+                low = middle + 1
+            else:
+                high = middle
+
+        return low
+
+    def __len__(self):
+        return self.__count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.__count:
+            raise IndexError(index)
+
+        return CatalogPackage(self, self.fields, self.__get_values(index))
+
+    def close(self):
+        self.__map.close()
+
+    def names(self):
+        """Get the names of all the packages, sorted."""
+        result = []
+
+        for index in range(self.__count):
+            name = self.__get_name(index)
+
+            if not result or result[-1] != name:
+                result.append(name)
+
+        return result
+
+    def simplePkgList(self):
+        """Get the package tuples of all the packages."""
+        indexes = [self.fields.index(field)
+                   for field in ("name", "arch", "epoch", "version", "release")]
+
+        result = []
+
+        for index in range(self.__count):
+            values = self.__get_values(index)
+            result.append(tuple([values[i] for i in indexes]))
+
+        return result
+
+    def read_description(self, offset, length):
+        start = self.__records_end + offset
+
+        return self.__map[start:start+length]
+
+    def returnPackages(self):
+        return [self[index] for index in range(self.__count)]
+
+    def searchNames(self, names):
+        """Get all the packages with one of the specified names."""
+        result = []
+
+        for name in sorted(set(names)):
+            index = self.__bisect(name)
+
+            while index < self.__count and self.__get_name(index) == name:
+                result.append(self[index])
+                index += 1
+
+        return result
+
+
+class InstalledSet(object):
+    """The installed packages, for quick "is this installed?" answers."""
+    def __init__(self, pkgtups):
+        self.pkgtups = set(pkgtups)
+        self.names = set()
+
+        self.__by_name_arch = {}
+
+        for pkgtup in self.pkgtups:
+            self.names.add(pkgtup[0])
+            self.__by_name_arch.setdefault(pkgtup[:2], []).append(pkgtup)
+
+    def search(self, name, arch):
+        """Get the package tuples of the installed name.arch packages."""
+        return self.__by_name_arch.get((name, arch), [])
+
+
+def get_rpmdb_cookie(installroot="/"):
+    """Get a cookie which changes every time the rpmdb is modified."""
+    # rpm is slow to import, and quick commands don't always need it
+    import rpm
+
+    dbpath = os.path.join(installroot,
+                          rpm.expandMacro("%{_dbpath}").lstrip("/"))
+
+    for dbfile in ("Packages", "rpmdb.sqlite"):
+        path = os.path.join(dbpath, dbfile)
+
+        if os.path.exists(path):
+            st = os.stat(path)
+
+            return "%s:%d:%d:%.6f" % (dbfile, st.st_ino, st.st_size,
+                                      st.st_mtime)
+
+    raise OSError(errno.ENOENT, "Could not find the rpmdb in %s" % dbpath)
+
+
+def open_catalog(path, key):
+    """Open a catalog, if it exists and was built for `key`.
+
+    Return None otherwise. If `key` is None, any catalog will do.
+    """
+    try:
+        catalog = PackageCatalog(path)
+
+    except (IOError, OSError, mmap.error, ValueError, KeyError,
+            struct.error):
+        return None
+
+    if key is not None and catalog.key != key:
+        catalog.close()
+        return None
+
+    return catalog
+
+
+def write_catalog(path, key, pkgs, fields=CATALOG_FIELDS):
+    """Write a catalog of packages.
+
+    The file is replaced atomically, so readers see either the old or the new
+    catalog, never a partially written one.
+    """
+    pkgs = sorted(pkgs, key=lambda pkg: (_to_str(pkg.name), pkg.pkgtup))
+
+    records = []
+    descriptions = []
+    descriptions_length = 0
+
+    for pkg in pkgs:
+        description = _to_str(pkg.description)
+
+        values = [_to_str(getattr(pkg, field)) for field in fields]
+        values.extend([str(descriptions_length), str(len(description))])
+
+        records.append("\0".join(values))
+        descriptions.append(description)
+        descriptions_length += len(description)
+
+    meta = json.dumps({"key": key, "fields": list(fields)})
+
+    offsets = []
+    offset = _header.size + len(meta) + (len(records) + 1) * _offset.size
+
+    for record in records:
+        offsets.append(_offset.pack(offset))
+        offset += len(record)
+
+    # The end of the last record
+    offsets.append(_offset.pack(offset))
+
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+
+    with open(tmp_path, "wb") as f:
+        f.write(_header.pack(CATALOG_MAGIC, CATALOG_VERSION, len(meta),
+                             len(records)))
+        f.write(meta)
+        f.write("".join(offsets))
+        f.write("".join(records))
+        f.write("".join(descriptions))
+
+    os.rename(tmp_path, path)
+
+
+def _compare_evr(pkg1, pkg2):
+    import rpm
+
+    return rpm.labelCompare((pkg1.epoch, pkg1.version, pkg1.release),
+                            (pkg2.epoch, pkg2.version, pkg2.release))
+
+def _newest(pkgs):
+    newest = None
+
+    for pkg in pkgs:
+        if newest is None or _compare_evr(pkg, newest) > 0:
+            newest = pkg
+
+    return newest
+
+def best_packages(pkgs, archlist=None):
+    """Get the best packages from a list of packages sharing the same name.
+
+    This follows what YumBase.bestPackagesFromList() does, except that it
+    only compares versions, which is all we need for catalog packages:
+        - the newest package is chosen for each of noarch, multilib and
+          singlelib arches;
+        - a noarch package wins if it is newer than the others.
+    """
+    from rpmUtils.arch import isMultiLibArch
+
+    multilib, singlelib, noarch = [], [], []
+
+    for pkg in pkgs:
+        if archlist is not None and pkg.arch not in archlist:
+            continue
+
+        elif pkg.arch == "noarch":
+            noarch.append(pkg)
+
+        elif isMultiLibArch(arch=pkg.arch):
+            multilib.append(pkg)
+
+        else:
+            singlelib.append(pkg)
+
+    multi = _newest(multilib)
+    single = _newest(singlelib)
+    no = _newest(noarch)
+
+    archful = [pkg for pkg in (multi, single) if pkg is not None]
+
+    if no is None:
+        return archful
+
+    newest = archful and (multi or single) or None
+
+    if newest is None or _compare_evr(no, newest) > 0:
+        return [no]
+
+    return archful
@@ -2,6 +2,16 @@ class NBYumException(Exception):
     """Generic exception that we'll raise when appropriate."""
     pass
 
+class ParserExit(NBYumException):
+    """Exception raised when parsing arguments would have exited.
+
+    For example after printing the help.
+    """
+    def __init__(self, status, message=None):
+        NBYumException.__init__(self, message)
+        self.status = status
+        self.message = message
+
 class WTFException(Exception):
     """Exception raised when we have no idea what happened.
 
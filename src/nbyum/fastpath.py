@@ -0,0 +1,269 @@
+"""Answer some read-only commands without loading Yum at all.
+
+Health checks call `last-updated' and `list installed' very often, and setting
+up Yum costs much more than answering them. The full Yum path keeps stamps
+and snapshots up to date for those, which we read directly here.
+
+Whenever we can't be sure to give the same answer as the Yum path, we let it
+answer instead.
+"""
+import ConfigParser
+from itertools import groupby
+from operator import attrgetter
+import os
+import sqlite3
+
+from .catalog import best_packages, get_rpmdb_cookie, open_catalog
+from .history import (find_history_db, get_max_tid, query_last_updated,
+                      read_last_update_stamp, write_last_update_stamp)
+from .output import get_emitter, recap_packages
+from .patterns import PatternMatcher, sanitize_patterns
+from .snapshot import get_current_snapshot
+from .utils import timestamp_to_iso_local_datetime
+
+
+DEFAULT_CONFIG = "/etc/yum.conf"
+
+# Where Yum writes the pid of the process holding its lock, in the installroot
+YUM_PID_FILE = "var/run/yum.pid"
+
+
+def get_paths(config=None):
+    """Get the installroot and persistdir from the Yum configuration.
+
+    Return None if we can't be sure to get them right, e.g when they use Yum
+    variables.
+    """
+    parser = ConfigParser.RawConfigParser()
+
+    try:
+        if not parser.read(config or DEFAULT_CONFIG):
+            return None
+
+    except ConfigParser.Error:
+        return None
+
+    def get(option, default):
+        if parser.has_option("main", option):
+            return parser.get("main", option)
+
+        return default
+
+    installroot = get("installroot", "/")
+    persistdir = get("persistdir", "/var/lib/yum")
+
+    if "$" in installroot or "$" in persistdir:
+        return None
+
+    # Yum puts its persistdir inside the installroot
+    persistdir = os.path.normpath(os.path.join(installroot,
+                                               persistdir.lstrip("/")))
+
+    return installroot, persistdir
+
+def last_updated(args):
+    """Print the date of the last update, from the history database."""
+    paths = get_paths(args.config)
+    if paths is None:
+        return False
+
+    installroot, persistdir = paths
+
+    db_path = find_history_db(persistdir)
+    if db_path is None:
+        return False
+
+    stamp_path = os.path.join(persistdir, "nbyum", "last-update.json")
+
+    conn = sqlite3.connect(db_path)
+
+    try:
+        cursor = conn.cursor()
+        max_tid = get_max_tid(cursor)
+
+        valid, last_update = read_last_update_stamp(stamp_path, max_tid)
+
+        if not valid:
+            last_update = query_last_updated(cursor)
+
+            try:
+                write_last_update_stamp(stamp_path, max_tid, last_update)
+            except (IOError, OSError):
+                pass
+
+    finally:
+        conn.close()
+
+    if last_update is not None:
+        get_emitter().emit({"type": "recap",
+                            "last_update":
+                                timestamp_to_iso_local_datetime(last_update)})
+
+    return True
+
+def get_lock_holder(installroot):
+    """Get the pid of the process holding the Yum lock, if any."""
+    try:
+        with open(os.path.join(installroot, YUM_PID_FILE)) as f:
+            pid = int(f.read().strip())
+
+    except (IOError, ValueError):
+        return None
+
+    if pid == os.getpid() or not os.path.exists("/proc/%d" % pid):
+        # Left over by a process which died
+        return None
+
+    return pid
+
+def _get_type_filter(type_):
+    if type_ == "sms":
+        return lambda pkg: pkg.name.startswith("nbsm-")
+
+    return lambda pkg: not pkg.name.startswith("nbsm-")
+
+def _get_best_packages(catalog, patterns, pkg_filter):
+    """Get the best of the packages matching the patterns in a catalog.
+
+    This does the same as NBYumBase.__get_packages_list() on catalogs.
+    """
+    names = PatternMatcher(patterns).filter(catalog.names())
+    pkgs = [pkg for pkg in catalog.searchNames(names) if pkg_filter(pkg)]
+
+    # This imports rpm, which we only need once there is something to list
+    from rpmUtils.arch import getArchList
+
+    archlist = getArchList()
+
+    best = []
+    for name, group in groupby(pkgs, attrgetter("name")):
+        best.extend(best_packages(group, archlist))
+
+    return best
+
+def list_installed(args):
+    """List installed packages, from the up to date snapshot."""
+    paths = get_paths(args.config)
+    if paths is None:
+        return False
+
+    installroot, persistdir = paths
+
+    key = {"rpmdb": get_rpmdb_cookie(installroot)}
+    snapshot = open_catalog(os.path.join(persistdir, "nbyum",
+                                         "installed.catalog"), key)
+    if snapshot is None:
+        return False
+
+    try:
+        patterns = sanitize_patterns(args.patterns, args.type)
+        best = _get_best_packages(snapshot, patterns,
+                                  _get_type_filter(args.type))
+
+        from rpmUtils.arch import getBaseArch
+
+        recap_packages([("installed", best)], args.fields, getBaseArch(),
+                       stream=args.stream)
+
+    finally:
+        snapshot.close()
+
+    return True
+
+def list_published(args):
+    """List packages from the published snapshot, while Yum is busy.
+
+    The installed packages and the repositories might be changing under the
+    feet of the lock holder, so rather than waiting for it we answer from the
+    last consistent state it published.
+    """
+    paths = get_paths(args.config)
+    if paths is None:
+        return False
+
+    installroot, persistdir = paths
+
+    if get_lock_holder(installroot) is None:
+        return False
+
+    snapshot_dir = get_current_snapshot(os.path.join(persistdir, "nbyum",
+                                                     "snapshots"))
+    if snapshot_dir is None:
+        return False
+
+    installed = open_catalog(os.path.join(snapshot_dir, "installed.catalog"),
+                             None)
+    if installed is None:
+        return False
+
+    available = None
+
+    try:
+        if args.filter in ("all", "available"):
+            available = open_catalog(os.path.join(snapshot_dir,
+                                                  "available.catalog"), None)
+            if available is None:
+                return False
+
+        patterns = sanitize_patterns(args.patterns, args.type)
+        type_filter = _get_type_filter(args.type)
+
+        results = []
+
+        if args.filter in ("all", "installed"):
+            results.append(("installed",
+                            _get_best_packages(installed, patterns,
+                                               type_filter)))
+
+        if args.filter in ("all", "available"):
+            installed_pkgtups = set(installed.simplePkgList())
+            installed_names = set(installed.names())
+
+            def available_filter(pkg):
+                if not type_filter(pkg) or pkg.pkgtup in installed_pkgtups:
+                    return False
+
+                # For security modules, we only want to show the ones that
+                # are **not installed**, even if in a different version
+                return args.type != "sms" or pkg.name not in installed_names
+
+            best = _get_best_packages(available, patterns, available_filter)
+
+            if not args.show_hidden:
+                best = [pkg for pkg in best if pkg.group != "nbhidden"]
+
+            results.append(("available", best))
+
+        from rpmUtils.arch import getBaseArch
+
+        recap_packages(results, args.fields, getBaseArch(),
+                       stream=args.stream)
+
+    finally:
+        installed.close()
+
+        if available is not None:
+            available.close()
+
+    return True
+
+def run(args):
+    """Answer the requested command, if possible.
+
+    Return whether it was answered.
+    """
+    try:
+        if args.func == "last_updated":
+            return last_updated(args)
+
+        if args.func == "list":
+            if list_published(args):
+                return True
+
+            if args.filter == "installed":
+                return list_installed(args)
+
+    except (IOError, OSError, sqlite3.Error):
+        pass
+
+    return False
@@ -0,0 +1,81 @@
+import glob
+import json
+import os
+
+
+# The states of packages in the history which make a transaction an update
+UPDATE_STATES = ("Update", "Obsoleted", "Install")
+
+
+def find_history_db(persistdir):
+    """Get the path of the history database Yum currently writes to.
+
+    Return None if there is none yet.
+    """
+    paths = sorted(glob.glob(os.path.join(persistdir, "history",
+                                          "history-*-*-*.sqlite")))
+
+    if paths:
+        return paths[-1]
+
+def get_max_tid(cursor):
+    """Get the id of the newest complete transaction in the history.
+
+    A running transaction must not count: a stamp written while it runs
+    would still look valid once it is over.
+    """
+    cursor.execute("SELECT MAX(tid) FROM trans_end")
+
+    return cursor.fetchone()[0]
+
+def query_last_updated(cursor):
+    """Get the timestamp of the last transaction which updated packages.
+
+    The newest complete transactions are looked at first, and we stop at the
+    first one which updated something, without loading any of them.
+    """
+    cursor.execute("SELECT te.timestamp FROM trans_end te "
+                   "WHERE EXISTS (SELECT 1 FROM trans_data_pkgs tdp "
+                   "              WHERE tdp.tid = te.tid "
+                   "              AND tdp.state IN (?, ?, ?)) "
+                   "ORDER BY te.timestamp DESC LIMIT 1",
+                   UPDATE_STATES)
+
+    row = cursor.fetchone()
+
+    if row is not None:
+        return row[0]
+
+def read_last_update_stamp(path, max_tid):
+    """Read the last update from its stamp, if it is still valid.
+
+    The stamp is valid as long as no transaction happened since it was
+    written, so it is only returned if it was written when `max_tid` was the
+    newest complete transaction.
+
+    Return whether the stamp is valid, and the last update it contains.
+    """
+    try:
+        with open(path) as f:
+            stamp = json.load(f)
+
+        if stamp["tid"] == max_tid:
+            return True, stamp["timestamp"]
+
+    except (IOError, ValueError, KeyError, TypeError):
+        pass
+
+    return False, None
+
+def write_last_update_stamp(path, max_tid, last_update):
+    """Write the last update stamp, atomically."""
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    tmp_path = "%s.%s.tmp" % (path, os.getpid())
+
+    with open(tmp_path, "w") as f:
+        json.dump({"tid": max_tid, "timestamp": last_update}, f)
+
+    os.rename(tmp_path, path)
@@ -0,0 +1,149 @@
+import errno
+import fcntl
+import json
+import math
+import os
+
+
+# The journal is rotated when it gets bigger than this, in bytes...
+JOURNAL_MAX_SIZE = 1024 * 1024
+
+# ... keeping that many of the previous ones around
+JOURNAL_ROTATIONS = 4
+
+# The percentiles we compute in the statistics
+PERCENTILES = (50, 90, 99)
+
+
+def _rotated_path(path, index):
+    return "%s.%d" % (path, index)
+
+def _journal_too_big(path):
+    try:
+        return os.path.getsize(path) >= JOURNAL_MAX_SIZE
+
+    except OSError:
+        # No journal yet
+        return False
+
+def _rename(src, dst):
+    """Rename a journal, unless a concurrent rotation already moved it."""
+    try:
+        os.rename(src, dst)
+
+    except OSError, e:
+        if e.errno != errno.ENOENT:
+            raise
+
+def rotate_journal(path):
+    """Rotate the journal, if it got too big.
+
+    Concurrent invocations might want to rotate it at the same time, so this
+    happens under a lock, and only the first one actually rotates it.
+    """
+    if not _journal_too_big(path):
+        return
+
+    with open("%s.lock" % path, "a") as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+
+        if not _journal_too_big(path):
+            # Somebody else rotated it while we were waiting
+            return
+
+        for index in range(JOURNAL_ROTATIONS - 1, 0, -1):
+            _rename(_rotated_path(path, index), _rotated_path(path, index + 1))
+
+        _rename(path, _rotated_path(path, 1))
+
+def append_entry(path, entry):
+    """Append an entry to the journal.
+
+    Each entry is written at once on its own line, in append mode, so that
+    concurrent invocations don't mix their entries.
+    """
+    dirname = os.path.dirname(path)
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    rotate_journal(path)
+
+    with open(path, "a") as f:
+        f.write("%s\n" % json.dumps(entry, default=str))
+
+def read_entries(path):
+    """Get all the entries of the journal, oldest first."""
+    paths = [_rotated_path(path, index)
+             for index in range(JOURNAL_ROTATIONS, 0, -1)]
+    paths.append(path)
+
+    for p in paths:
+        if not os.path.exists(p):
+            continue
+
+        with open(p) as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+
+                except ValueError:
+                    # e.g a line cut short by a full disk
+                    continue
+
+
+def percentiles(values):
+    """Summarize values with a few percentiles, and their maximum.
+
+    This uses the nearest-rank method, so that all the numbers are values
+    which were actually measured.
+    """
+    values = sorted(values)
+    result = {"max": values[-1]}
+
+    for p in PERCENTILES:
+        rank = max(int(math.ceil(p / 100.0 * len(values))), 1)
+        result["p%d" % p] = values[rank - 1]
+
+    return result
+
+def aggregate(entries):
+    """Aggregate journal entries into statistics, per command."""
+    commands = {}
+
+    for entry in entries:
+        command = commands.setdefault(entry.get("command"),
+                                      {"count": 0, "failures": 0,
+                                       "duration": [], "stages": {},
+                                       "counters": {}})
+
+        command["count"] += 1
+
+        if entry.get("exit_code"):
+            command["failures"] += 1
+
+        command["duration"].append(entry.get("duration", 0))
+
+        for name, seconds in entry.get("stages", {}).items():
+            command["stages"].setdefault(name, []).append(seconds)
+
+        for name, value in entry.get("counters", {}).items():
+            command["counters"].setdefault(name, []).append(value)
+
+    result = {}
+
+    for name, command in commands.items():
+        stats = {"count": command["count"],
+                 "failures": command["failures"],
+                 "duration": percentiles(command["duration"])}
+
+        if command["stages"]:
+            stats["stages"] = dict([(stage, percentiles(values))
+                                    for stage, values
+                                    in command["stages"].items()])
+
+        for counter, values in command["counters"].items():
+            stats[counter] = percentiles(values)
+
+        result[name] = stats
+
+    return result
@@ -1,14 +1,15 @@
-import json
 import logging
-import sys
+import time
 
-from urlgrabber.progress import BaseMeter
+from urlgrabber.progress import BaseMeter, MultiFileMeter
 
 from yum.constants import (TS_UPDATE, TS_ERASE, TS_INSTALL, TS_TRUEINSTALL,
                            TS_OBSOLETED, TS_OBSOLETING, TS_UPDATED)
 from yum.rpmtrans import RPMBaseCallback
 
 from .errors import NBYumException, WTFException
+from .metrics import count, trace_event, tracing
+from .output import get_emitter
 
 
 # Our custom log levels
@@ -17,6 +18,10 @@ RECAP_LEVEL = 3141592
 
 
 class NBYumLogger(logging.Logger):
+    # Bumped every time a handler is added or removed from any of our
+    # loggers, so that they know when to look for Yum's syslog handler again
+    _handlers_generation = 0
+
     log_progress = lambda self, msg: self.log(PROGRESS_LEVEL, msg)
     log_recap = lambda self, msg: self.log(RECAP_LEVEL, msg)
 
@@ -44,8 +49,7 @@ class NBYumLogger(logging.Logger):
                     hdlr.handle(record)
 
             else:
-                sys.stdout.write("%s\n" % json.dumps({"type": "log",
-                                                      level: record.getMessage()}))
+                get_emitter().emit({"type": "log", level: record.getMessage()})
 
         elif level == "recap":
             d = {"type": level}
@@ -56,22 +60,49 @@ class NBYumLogger(logging.Logger):
             #   - `v` is a list of dicts, each representing a package
             d.update(record.msg)
 
-            sys.stdout.write("%s\n" % json.dumps(d))
+            get_emitter().emit(d)
 
         elif level == "progress":
             # `record.msg` is a dict
-            sys.stdout.write("%s\n" % json.dumps({"type": level,
-                                                  "current": record.msg["current"],
-                                                  "total": record.msg["total"],
-                                                  "hint": record.msg["hint"]}))
+            d = {"type": level, "current": record.msg["current"],
+                 "total": record.msg["total"], "hint": record.msg["hint"]}
+
+            # Package downloads also report their bytes and throughput
+            for key in ("bytes_done", "bytes_total", "rate"):
+                if key in record.msg:
+                    d[key] = record.msg[key]
+
+            get_emitter().emit(d)
 
         else:
             raise WTFException("Got unexpected logging level: %s" % level)
 
-        sys.stdout.flush()
+    def addHandler(self, hdlr):
+        logging.Logger.addHandler(self, hdlr)
+        NBYumLogger._handlers_generation += 1
+
+    def removeHandler(self, hdlr):
+        logging.Logger.removeHandler(self, hdlr)
+        NBYumLogger._handlers_generation += 1
 
     def _get_syslog_handler(self):
-        """Get Yum's syslog handler, if there is one for this logger."""
+        """Get Yum's syslog handler, if there is one for this logger.
+
+        Walking up the logger hierarchy for each message is quite costly, so
+        the result is cached until the handlers change.
+        """
+        cache_key = (NBYumLogger._handlers_generation, self.propagate)
+        cached = getattr(self, "_syslog_handler_cache", None)
+
+        if cached is not None and cached[0] == cache_key:
+            return cached[1]
+
+        hdlr = self.__find_syslog_handler()
+        self._syslog_handler_cache = (cache_key, hdlr)
+
+        return hdlr
+
+    def __find_syslog_handler(self):
         for hdlr in self.handlers:
             if isinstance(hdlr, logging.handlers.SysLogHandler):
                 return hdlr
@@ -98,12 +129,26 @@ class NBYumRPMCallback(RPMBaseCallback):
         # When it's fixed, just nuke it out of here
         self.__installroot = installroot
 
+        # When we started processing the package, to trace it
+        self.__traced_package = None
+        self.__traced_start = None
+        self.__last_verified = None
+
     def event(self, package, action, te_current, te_total, ts_current, ts_total):
         """Log progression of the transaction."""
+        if tracing() and package is not self.__traced_package:
+            self.__traced_package = package
+            self.__traced_start = time.time()
+
         if te_current != te_total:
             # No progress bar, we only print packages completely processed
             return
 
+        if tracing():
+            trace_event(str(package), self.__traced_start, time.time(),
+                        {"action": self.action.get(action, action)})
+            self.__traced_package = None
+
         if action in self.action:
             self.logger.log_progress({"current": ts_current, "total": ts_total,
                                       "hint": "%s: %s" % (self.action[action],
@@ -135,13 +180,91 @@ class NBYumRPMCallback(RPMBaseCallback):
 
     def verify_txmbr(self, base, txmbr, count):
         """Log progression of the post-transaction verifications."""
+        if tracing():
+            # We are only told once a package was verified, so it took the
+            # time since the previous one
+            now = time.time()
+            trace_event("Verify %s" % txmbr.po, self.__last_verified or now,
+                        now)
+            self.__last_verified = now
+
         self.logger.log_progress({"current": count, "total": len(base.tsInfo),
                                   "hint": "Verified: %s" % str(txmbr.po)})
 
 
+class NBYumDownloadProgress(object):
+    """Aggregate the progress of all the package downloads.
+
+    Packages might be downloaded concurrently, so rather than one progress
+    bar per package, we report the number of packages downloaded, the bytes
+    downloaded, and the overall throughput. Updates are throttled to one
+    every `interval` seconds, except for the last one.
+    """
+    def __init__(self, interval=0.25):
+        self.logger = logging.getLogger("yum")
+        self.interval = interval
+
+        self.start(0, 0)
+
+    def start(self, files_total, bytes_total):
+        """Start tracking a new batch of downloads."""
+        self.files_total = files_total
+        self.bytes_total = bytes_total
+
+        self.files_done = 0
+        self.__bytes_finished = 0
+        self.__bytes_current = {}
+
+        self.__started = time.time()
+        self.__last_log = 0
+
+    def update(self, key, amount_read, now=None):
+        """Update the progress of the download identified by `key`."""
+        self.__bytes_current[key] = amount_read
+        self.__log(now)
+
+    def end(self, key, size, now=None):
+        """Mark the download identified by `key` as done."""
+        self.__bytes_current.pop(key, None)
+        self.__bytes_finished += size
+        self.files_done += 1
+        count("bytes_downloaded", size)
+
+        self.__log(now, force=(self.files_done >= self.files_total))
+
+    def __log(self, now=None, force=False):
+        if not self.files_total:
+            # Not downloading packages
+            return
+
+        if now is None:
+            now = time.time()
+
+        if not force and now - self.__last_log < self.interval:
+            return
+
+        self.__last_log = now
+
+        bytes_done = self.__bytes_finished + sum(self.__bytes_current.values())
+        elapsed = now - self.__started
+
+        if elapsed > 0:
+            rate = int(bytes_done / elapsed)
+        else:
+            rate = 0
+
+        self.logger.log_progress({"current": self.files_done,
+                                  "total": self.files_total,
+                                  "hint": "Downloading the packages...",
+                                  "bytes_done": bytes_done,
+                                  "bytes_total": self.bytes_total,
+                                  "rate": rate})
+
+
 class NBYumTextMeter(BaseMeter):
-    def __init__(self):
+    def __init__(self, download_progress=None):
         self.logger = logging.getLogger("yum")
+        self.download_progress = download_progress
         BaseMeter.__init__(self)
 
     def _do_start(self, now=None):
@@ -152,3 +275,34 @@ class NBYumTextMeter(BaseMeter):
                                   "type": "progress",
                                   "hint": "Downloading %s..."
                                           % self.basename})
+
+    def _do_update(self, amount_read, now=None):
+        if self.download_progress is None or \
+           not self.basename.endswith(".rpm"):
+            return
+
+        self.download_progress.update(self.basename, amount_read, now)
+
+    def _do_end(self, amount_read, now=None):
+        if self.download_progress is None or \
+           not self.basename.endswith(".rpm"):
+            return
+
+        self.download_progress.end(self.basename, amount_read, now)
+
+
+class NBYumMultiFileMeter(MultiFileMeter):
+    """The meter Yum uses when downloading packages concurrently."""
+    def __init__(self, download_progress):
+        self.download_progress = download_progress
+        MultiFileMeter.__init__(self)
+
+    def _do_update_meter(self, meter, now):
+        if meter.basename.endswith(".rpm"):
+            self.download_progress.update(meter.basename,
+                                          meter.last_amount_read, now)
+
+    def _do_end_meter(self, meter, now):
+        if meter.basename.endswith(".rpm"):
+            self.download_progress.end(meter.basename,
+                                       meter.last_amount_read, now)
@@ -0,0 +1,219 @@
+import atexit
+from functools import wraps
+import json
+import os
+import resource
+import thread
+import time
+
+from .output import get_emitter
+
+
+# Whether the stages are measured at all, see enable_timings()
+_enabled = False
+
+# The trace being recorded, if any, see start_trace()
+_trace = None
+
+# What the trace file starts and ends with, events go in between
+TRACE_HEADER = '{"displayTimeUnit": "ms", "traceEvents": [\n'
+TRACE_FOOTER = "]}\n"
+
+# What the running commands went through, innermost last, see start_record()
+_records = []
+
+
+def enable_timings(enabled=True):
+    """Print a `metrics' line at the end of each stage of the commands."""
+    global _enabled
+    _enabled = enabled
+
+def _measure():
+    """Get the wall time, CPU time and peak RSS of the process so far."""
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+
+    return time.time(), usage.ru_utime + usage.ru_stime, usage.ru_maxrss
+
+
+def start_record():
+    """Start recording the stages and counters of a command.
+
+    Commands can run other commands, e.g `nbyum batch', in which case only
+    the innermost one records anything.
+    """
+    _records.append({"stages": {}, "counters": {}})
+
+def stop_record():
+    """Stop recording the current command, and get what it went through."""
+    return _records.pop()
+
+def count(name, amount):
+    """Add to a counter of the current command."""
+    if _records:
+        counters = _records[-1]["counters"]
+        counters[name] = counters.get(name, 0) + amount
+
+def _record_stage(name, seconds):
+    if _records:
+        stages = _records[-1]["stages"]
+        stages[name] = stages.get(name, 0) + seconds
+
+
+def start_trace(path, profile=False):
+    """Record the spans into a trace file.
+
+    The file uses the Chrome trace event format, which Perfetto or
+    chrome://tracing can open. The spans are written when we exit, or when
+    flush_trace() is called.
+
+    With `profile`, the whole run is also profiled with cProfile, and the
+    statistics are written next to the trace, in `path`.prof.
+    """
+    global _trace
+
+    profiler = None
+
+    if profile:
+        import cProfile
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+    with open(path, "w") as f:
+        f.write(TRACE_HEADER)
+        f.write(TRACE_FOOTER)
+
+    _trace = {"path": path, "events": [], "written": 0, "profiler": profiler}
+    atexit.register(write_trace)
+
+def trace_event(name, start, end, args=None):
+    """Record a span which started and ended at the specified times."""
+    if _trace is None:
+        return
+
+    event = {"name": name, "ph": "X", "pid": os.getpid(),
+             "tid": thread.get_ident(), "ts": int(start * 1000000),
+             "dur": int((end - start) * 1000000)}
+
+    if args:
+        event["args"] = args
+
+    _trace["events"].append(event)
+
+def tracing():
+    """Whether spans are currently recorded."""
+    return _trace is not None
+
+def flush_trace():
+    """Append the spans recorded so far to the trace file, and forget them.
+
+    This keeps long running processes, e.g `nbyum serve', from accumulating
+    spans forever. The file is complete after each call.
+    """
+    if _trace is None or not _trace["events"]:
+        return
+
+    with open(_trace["path"], "r+") as f:
+        f.seek(-len(TRACE_FOOTER), os.SEEK_END)
+
+        for event in _trace["events"]:
+            if _trace["written"]:
+                f.write(",\n")
+
+            f.write(json.dumps(event))
+            _trace["written"] += 1
+
+        f.write(TRACE_FOOTER)
+        f.truncate()
+
+    del _trace["events"][:]
+
+def write_trace():
+    """Write the rest of the trace, and the profile if any."""
+    global _trace
+
+    if _trace is None:
+        return
+
+    flush_trace()
+
+    trace, _trace = _trace, None
+
+    if trace["profiler"] is not None:
+        trace["profiler"].disable()
+        trace["profiler"].dump_stats("%s.prof" % trace["path"])
+
+
+class span(object):
+    """Record a span of a command in the trace, when tracing.
+
+    This can be used either as a context manager or as a function decorator.
+    Spans happening inside other spans are shown nested in the trace.
+    """
+    def __init__(self, name, **args):
+        self.name = name
+        self.args = args
+
+        # Spans can be reentered, e.g when decorating recursive functions
+        self.__starts = []
+
+    def __enter__(self):
+        if tracing():
+            self.__starts.append(time.time())
+
+        else:
+            self.__starts.append(None)
+
+    def __exit__(self, *exc_info):
+        start = self.__starts.pop()
+
+        if start is not None:
+            trace_event(self.name, start, time.time(), self.args)
+
+    def __call__(self, func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with self:
+                return func(*args, **kwargs)
+
+        return wrapper
+
+
+class stage(span):
+    """Measure a stage of a command.
+
+    Its duration is recorded for the journal, and when timings are enabled a
+    `metrics' line tells the wall and CPU time it took, as well as the peak
+    RSS of the process so far, in kilobytes. Stages are also spans of the
+    trace.
+    """
+    def __init__(self, name):
+        span.__init__(self, name)
+
+        self.__measures = []
+
+    def __enter__(self):
+        span.__enter__(self)
+
+        if _enabled:
+            self.__measures.append(_measure())
+
+        else:
+            self.__measures.append((time.time(), None, None))
+
+    def __exit__(self, *exc_info):
+        span.__exit__(self, *exc_info)
+
+        start = self.__measures.pop()
+
+        if not _enabled:
+            _record_stage(self.name, time.time() - start[0])
+            return
+
+        wall, cpu, maxrss = _measure()
+        _record_stage(self.name, wall - start[0])
+
+        get_emitter().emit({"type": "metrics", "stage": self.name,
+                            "wall": round(wall - start[0], 3),
+                            "cpu": round(cpu - start[1], 3),
+                            "maxrss": maxrss})
@@ -0,0 +1,174 @@
+import json
+import sys
+import time
+
+from .utils import dedupe_multiarch, get_pkgdict, list_ordergetter
+
+
+class NBYumEmitter(object):
+    """Write our JSON objects to a stream, one per line.
+
+    By default each line is flushed as soon as it is written. The
+    `flush_policy` can instead be one of:
+        - ("time", SECONDS): flush when that much time passed since the
+          previous flush;
+        - ("size", BYTES): flush when that many bytes are waiting.
+
+    When `progress_window` is set, progress lines less than that many seconds
+    apart are coalesced: only the latest one is written, right before the
+    next line of another type, or when the output is flushed.
+
+    Additional members passed to the constructor are added to each object
+    written, for example to tag them with the id of the request they answer.
+    """
+    def __init__(self, stream=None, flush_policy=("line", None),
+                 progress_window=None, **extra):
+        self.stream = stream
+        self.flush_policy = flush_policy
+        self.progress_window = progress_window
+        self.extra = extra
+
+        self.__buffer = []
+        self.__buffered = 0
+        self.__last_flush = time.time()
+
+        self.__progress = None
+        self.__last_progress = 0
+
+    def emit(self, obj):
+        if self.progress_window and obj.get("type") == "progress":
+            now = time.time()
+
+            if now - self.__last_progress < self.progress_window:
+                # Only the latest state matters
+                self.__progress = obj
+                return
+
+            self.__progress = None
+            self.__last_progress = now
+
+        elif self.__progress is not None:
+            self.__append(self.__progress)
+            self.__progress = None
+
+        self.__append(obj)
+
+        policy, value = self.flush_policy
+
+        if policy == "line" or \
+           (policy == "size" and self.__buffered >= value) or \
+           (policy == "time" and time.time() - self.__last_flush >= value):
+            self.__flush_buffer()
+
+    def flush(self):
+        """Write everything we held back."""
+        if self.__progress is not None:
+            self.__append(self.__progress)
+            self.__progress = None
+
+        self.__flush_buffer()
+
+    def __append(self, obj):
+        if self.extra:
+            obj = dict(obj, **self.extra)
+
+        line = "%s\n" % json.dumps(obj)
+
+        self.__buffer.append(line)
+        self.__buffered += len(line)
+
+    def __flush_buffer(self):
+        # Resolve stdout as late as possible, in case it got replaced
+        stream = self.stream or sys.stdout
+
+        if self.__buffer:
+            stream.write("".join(self.__buffer))
+
+            self.__buffer = []
+            self.__buffered = 0
+
+        stream.flush()
+        self.__last_flush = time.time()
+
+
+class NBYumRecorder(object):
+    """Forward our JSON objects to another emitter, keeping a copy of them.
+
+    Debug messages and metrics are not kept, as they only make sense when
+    they happen.
+    """
+    def __init__(self, emitter):
+        self.emitter = emitter
+        self.recorded = []
+
+    def emit(self, obj):
+        type_ = obj.get("type")
+
+        if type_ != "metrics" and not (type_ == "log" and "debug" in obj):
+            self.recorded.append(obj)
+
+        self.emitter.emit(obj)
+
+    def flush(self):
+        self.emitter.flush()
+
+
+# Where our JSON objects are written
+_emitter = NBYumEmitter()
+
+def get_emitter():
+    """Get the emitter currently used to write our JSON objects."""
+    return _emitter
+
+def set_emitter(emitter):
+    """Change the emitter used to write our JSON objects.
+
+    Return the previous one, so that it can be restored afterwards.
+    """
+    global _emitter
+
+    previous = _emitter
+    _emitter = emitter
+
+    return previous
+
+
+def recap_packages(results, fields, basearch, stream=False):
+    """Print the recap of listed packages.
+
+    `results` is a list of (key, pkgs), where `key` is the member of the
+    recap under which the corresponding packages are printed, as dicts
+    of their requested `fields`.
+
+    When streaming, each package is printed on its own `recap-item` line
+    as soon as it is ready, followed by a `recap-end` line with the
+    number of packages for each key.
+    """
+    emitter = get_emitter()
+    recap = {}
+    counts = {}
+
+    for key, pkgs in results:
+        pkgs = dedupe_multiarch(sorted(pkgs, key=list_ordergetter), basearch)
+
+        if stream:
+            counts[key] = 0
+
+            for pkg in pkgs:
+                emitter.emit({"type": "recap-item",
+                              key: get_pkgdict(pkg, fields)})
+                counts[key] += 1
+
+        else:
+            pkgdicts = [get_pkgdict(pkg, fields) for pkg in pkgs]
+
+            if pkgdicts:
+                recap[key] = pkgdicts
+
+    if stream:
+        counts["type"] = "recap-end"
+        emitter.emit(counts)
+
+    elif recap:
+        recap["type"] = "recap"
+        emitter.emit(recap)
@@ -0,0 +1,195 @@
+from bisect import bisect_left
+import re
+
+from .metrics import span
+
+
+# Characters with a special meaning in glob patterns
+GLOB_CHARS = "*?["
+
+
+def _literal_prefix(pattern):
+    """Get the part of a pattern before its first special character."""
+    for index, c in enumerate(pattern):
+        if c in GLOB_CHARS:
+            return pattern[:index]
+
+    return pattern
+
+def _translate(pattern):
+    """Translate a glob pattern into a regular expression.
+
+    This does the same as fnmatch.translate(), except that it doesn't append
+    the end of string anchor and the flags, so that the result can be
+    combined with others.
+    """
+    i, n = 0, len(pattern)
+    result = ""
+
+    while i < n:
+        c = pattern[i]
+        i += 1
+
+        if c == "*":
+            result += ".*"
+
+        elif c == "?":
+            result += "."
+
+        elif c == "[":
+            j = i
+
+            if j < n and pattern[j] == "!":
+                j += 1
+            if j < n and pattern[j] == "]":
+                j += 1
+            while j < n and pattern[j] != "]":
+                j += 1
+
+            if j >= n:
+                result += "\\["
+
+            else:
+                stuff = pattern[i:j].replace("\\", "\\\\")
+                i = j + 1
+
+                if stuff[0] == "!":
+                    stuff = "^" + stuff[1:]
+                elif stuff[0] == "^":
+                    stuff = "\\" + stuff
+
+                result += "[%s]" % stuff
+
+        else:
+            result += re.escape(c)
+
+    return result
+
+def _compile(patterns):
+    return re.compile("(?:%s)\\Z" % "|".join(["(?:%s)" % _translate(p)
+                                              for p in patterns]),
+                      re.DOTALL)
+
+
+def smsize_patterns(patterns):
+    """Pre-process patterns when matching security modules.
+
+    If a user specifies a pattern like 'b*', then the 'nbsm-base' security
+    module should match.
+    """
+    result = []
+    for pattern in patterns:
+        if not pattern.startswith("nbsm"):
+            pattern = "nbsm-%s" % pattern
+
+        result.append(pattern)
+
+    return result
+
+def sanitize_patterns(patterns, type_):
+    """Make sure the patterns are sound."""
+    if not patterns:
+        patterns = ["*"]
+
+    if type_ == "sms":
+        # Special case for the security modules
+        patterns = smsize_patterns(patterns)
+
+    return patterns
+
+
+class PatternMatcher(object):
+    """Match names against a list of glob patterns, all at once.
+
+    All the patterns are compiled into a single regular expression, and
+    their literal prefixes (e.g 'nbsm-' for 'nbsm-*') are used to only try
+    it on the names which can possibly match.
+    """
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+        self.__literals = set()
+        self.__globs = {}
+
+        for pattern in self.patterns:
+            prefix = _literal_prefix(pattern)
+
+            if prefix == pattern:
+                self.__literals.add(pattern)
+            else:
+                self.__globs.setdefault(prefix, []).append(pattern)
+
+        self.__regex = None
+        if self.__globs:
+            self.__regex = _compile([p for globs in self.__globs.values()
+                                       for p in globs])
+
+        # Names matching a prefix also match all of its own prefixes, so
+        # only keep the shortest ones to look for candidates
+        self.__prefixes = []
+        for prefix in sorted(self.__globs):
+            if not self.__prefixes or \
+               not prefix.startswith(self.__prefixes[-1]):
+                self.__prefixes.append(prefix)
+
+    def match(self, name):
+        """Whether a name matches any of the patterns."""
+        if name in self.__literals:
+            return True
+
+        return self.__regex is not None and \
+               self.__regex.match(name) is not None
+
+    @span("match_patterns")
+    def filter(self, names):
+        """Get the names matching any of the patterns.
+
+        `names` must be sorted, as we look for the candidates by bisecting it.
+        The result is sorted as well.
+        """
+        result = set()
+
+        for literal in self.__literals:
+            index = bisect_left(names, literal)
+
+            if index < len(names) and names[index] == literal:
+                result.add(literal)
+
+        for prefix in self.__prefixes:
+            index = bisect_left(names, prefix)
+
+            while index < len(names) and names[index].startswith(prefix):
+                if self.__regex.match(names[index]):
+                    result.add(names[index])
+
+                index += 1
+
+        return sorted(result)
+
+    @span("unmatched_patterns")
+    def unmatched(self, names):
+        """Get the patterns which don't match any of the (sorted) names."""
+        result = []
+
+        for pattern in self.patterns:
+            prefix = _literal_prefix(pattern)
+            index = bisect_left(names, prefix)
+
+            if prefix == pattern:
+                if index >= len(names) or names[index] != pattern:
+                    result.append(pattern)
+
+                continue
+
+            regex = _compile([pattern])
+
+            while index < len(names) and names[index].startswith(prefix):
+                if regex.match(names[index]):
+                    break
+
+                index += 1
+
+            else:
+                result.append(pattern)
+
+        return result
@@ -0,0 +1,103 @@
+import json
+import os
+import socket
+import time
+
+from .output import NBYumEmitter, set_emitter
+
+
+class NBYumServer(object):
+    """Serve nbyum requests on a Unix socket.
+
+    Each client connects, sends a single JSON object on one line, e.g:
+        {"id": 42, "args": ["list", "all", "sms"]}
+
+    It then receives the same lines that the corresponding `nbyum' command
+    would have printed, followed by a final `exit' line, after which the
+    connection is closed.
+
+    Requests are served one after the other, all of them against the same
+    Yum base, so that the package metadata is only loaded once.
+    """
+    def __init__(self, cli, path, max_age):
+        self.cli = cli
+        self.path = path
+        self.max_age = max_age
+
+    def serve_forever(self):
+        """Accept and serve requests, until we get killed."""
+        if os.path.exists(self.path):
+            # Left over by a previous instance
+            os.unlink(self.path)
+
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+
+        # Only root can talk to us
+        old_umask = os.umask(0077)
+        try:
+            sock.bind(self.path)
+        finally:
+            os.umask(old_umask)
+
+        sock.listen(5)
+
+        try:
+            while True:
+                conn, unused = sock.accept()
+
+                try:
+                    self.__handle(conn)
+
+                except (IOError, socket.error), e:
+                    # The client went away, there isn't much we can do
+                    self.cli.base.verbose_logger.debug("Lost a client: %s"
+                                                       % e)
+
+                finally:
+                    conn.close()
+
+        finally:
+            sock.close()
+            os.unlink(self.path)
+
+    def __handle(self, conn):
+        """Serve a single request."""
+        rfile = conn.makefile("r")
+        wfile = conn.makefile("w")
+
+        try:
+            emitter = NBYumEmitter(wfile, **self.cli.emitter_options)
+
+            try:
+                request = json.loads(rfile.readline())
+
+                # Tag the replies as soon as we can, even the errors
+                if isinstance(request, dict) and "id" in request:
+                    emitter.extra["id"] = request["id"]
+
+                argv = [str(arg) for arg in request["args"]]
+
+            except (ValueError, KeyError, TypeError), e:
+                emitter.emit({"type": "log",
+                              "error": "Invalid request: %s" % e})
+                emitter.emit({"type": "exit", "code": 2})
+                emitter.flush()
+                return
+
+            if self.cli.prepared_at is not None and \
+               time.time() - self.cli.prepared_at > self.max_age:
+                self.cli.reset()
+
+            previous = set_emitter(emitter)
+
+            try:
+                exit_code = self.cli.run_subcommand(argv)
+                emitter.emit({"type": "exit", "code": exit_code})
+
+            finally:
+                emitter.flush()
+                set_emitter(previous)
+
+        finally:
+            rfile.close()
+            wfile.close()
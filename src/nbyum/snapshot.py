@@ -0,0 +1,84 @@
+import errno
+import os
+import shutil
+import time
+
+
+# The installed packages snapshot and the available packages catalog are each
+# replaced whenever they change, independently of each other. Readers which
+# can't take the Yum lock need both from the same point in time though, and
+# not to see them change while the lock holder is modifying the system.
+#
+# So every time one of them changes, we publish a new version of the
+# snapshot: a directory holding both files, which never changes once it is
+# published. A `current' symlink is then atomically switched to it.
+
+# How many versions of the snapshot we keep around, for the readers which
+# might still be using the previous ones
+SNAPSHOT_KEEP = 3
+
+
+def get_current_snapshot(root):
+    """Get the directory of the current snapshot, or None if there is none."""
+    try:
+        version = os.readlink(os.path.join(root, "current"))
+
+    except OSError:
+        return None
+
+    return os.path.join(root, version)
+
+def publish_snapshot(root, files):
+    """Publish a new version of the snapshot.
+
+    `files` maps the names of the files in the snapshot to the paths they are
+    taken from. Those files are always replaced rather than modified, so
+    hard links to them are enough. Missing files are left out.
+
+    Return the directory of the new version.
+    """
+    version = "%017.6f-%d" % (time.time(), os.getpid())
+    tmp_dir = os.path.join(root, ".%s.tmp" % version)
+
+    os.makedirs(tmp_dir)
+
+    for name, path in files.items():
+        dest = os.path.join(tmp_dir, name)
+
+        try:
+            os.link(path, dest)
+
+        except OSError, e:
+            if e.errno == errno.ENOENT:
+                continue
+
+            elif e.errno == errno.EXDEV:
+                # The cache and the persistent directory can be on different
+                # file systems
+                shutil.copy2(path, dest)
+
+            else:
+                raise
+
+    version_dir = os.path.join(root, version)
+    os.rename(tmp_dir, version_dir)
+
+    tmp_link = os.path.join(root, ".current.%d.tmp" % os.getpid())
+    os.symlink(version, tmp_link)
+    os.rename(tmp_link, os.path.join(root, "current"))
+
+    prune_snapshots(root)
+
+    return version_dir
+
+def prune_snapshots(root, keep=SNAPSHOT_KEEP):
+    """Remove the oldest versions of the snapshot, except the current one."""
+    current = get_current_snapshot(root)
+    versions = sorted([name for name in os.listdir(root)
+                       if not name.startswith(".") and name != "current"])
+
+    for version in versions[:-keep]:
+        path = os.path.join(root, version)
+
+        if path != current:
+            shutil.rmtree(path, ignore_errors=True)
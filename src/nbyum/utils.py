@@ -5,9 +5,14 @@ import os
 import pwd
 import time
 
-from yum.Errors import LockError
+from errors import NBYumException, ParserExit, WTFException
 
-from errors import NBYumException, WTFException
+
+# The package attributes which `list' and `info' can print
+LIST_FIELDS = ("name", "version", "summary", "description")
+LIST_FIELD_CHOICES = ("name", "version", "arch", "summary", "description")
+INFO_FIELDS = ("name", "arch", "version", "license", "summary", "description",
+               "base_package_name")
 
 
 class DummyOpts(object):
@@ -34,6 +39,69 @@ class DummyOpts(object):
         return None
 
 
+# How long we wait between attempts to take the Yum lock, at first and at most
+LOCK_POLL_MIN = 0.05
+LOCK_POLL_MAX = 0.5
+
+
+class LockQueue(object):
+    """Serve the processes waiting for the Yum lock in order of arrival.
+
+    Each waiter takes a ticket, as a file named after its arrival time and its
+    pid, and only tries to take the lock once the tickets before its own are
+    gone. Tickets left over by processes which died are ignored.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.ticket = None
+
+    def join(self):
+        """Take a ticket."""
+        try:
+            os.makedirs(self.path)
+
+        except OSError, e:
+            if e.errno != errno.EEXIST:
+                raise
+
+        self.ticket = "%017.6f-%d" % (time.time(), os.getpid())
+        open(os.path.join(self.path, self.ticket), "w").close()
+
+    def is_first(self):
+        """Whether our ticket is the first one."""
+        for ticket in sorted(os.listdir(self.path)):
+            if ticket == self.ticket:
+                return True
+
+            try:
+                pid = int(ticket.rsplit("-", 1)[-1])
+
+            except ValueError:
+                continue
+
+            if os.path.exists("/proc/%d" % pid):
+                return False
+
+            # Left over by a process which died
+            self.__remove(ticket)
+
+        return True
+
+    def leave(self):
+        """Give our ticket back."""
+        if self.ticket is not None:
+            self.__remove(self.ticket)
+            self.ticket = None
+
+    def __remove(self, ticket):
+        try:
+            os.unlink(os.path.join(self.path, ticket))
+
+        except OSError, e:
+            if e.errno != errno.ENOENT:
+                raise
+
+
 class locked(object):
     """Decorator to run a function under the Yum lock"""
     def __init__(self, func):
@@ -45,12 +113,103 @@ class locked(object):
 
     def __call__(self, *args):
         """Run the decorated function, protected by the Yum lock"""
-        self.__acquire_lock()
-        self.__func(self.instance, *args)
-        self.__unlock()
+        # The metrics module needs this one, so we can't import it earlier
+        from .metrics import count, span
+
+        start = time.time()
+
+        with span("lock"):
+            self.__acquire_lock()
+
+        count("lock_wait", time.time() - start)
+
+        try:
+            self.__func(self.instance, *args)
+
+        finally:
+            # Long-running processes (e.g `nbyum serve') must not keep the
+            # lock when a command failed
+            with span("unlock"):
+                self.__unlock()
 
     def __acquire_lock(self):
-        """Acquire the Yum lock"""
+        """Acquire the Yum lock
+
+        With --wait-lock, wait for it to be released for that many seconds,
+        polling with an increasing delay. Waiting nbyum processes then get it
+        in their order of arrival.
+        """
+        # The fastpath module needs this one, so we can't import it earlier
+        from .fastpath import get_lock_holder
+
+        timeout = getattr(self.instance.args, "wait_lock", 0) or 0
+        deadline = time.time() + timeout
+        delay = LOCK_POLL_MIN
+
+        queue = None
+
+        if timeout > 0:
+            queue = LockQueue(os.path.join(self.instance.base.conf.persistdir,
+                                           "nbyum", "lock-queue"))
+            queue.join()
+
+        # Looking the owner up is costly, only do it when it changes
+        lock_owner = None
+
+        try:
+            while True:
+                if queue is None or queue.is_first():
+                    locking_pid = self.__try_lock()
+
+                    if locking_pid is None:
+                        return
+
+                else:
+                    # Not our turn yet, still tell who is holding the lock
+                    locking_pid = get_lock_holder(
+                            self.instance.base.conf.installroot)
+
+                if locking_pid is not None and \
+                   (lock_owner is None or lock_owner["pid"] != locking_pid):
+                    try:
+                        lock_owner = self.__get_lock_owner(locking_pid)
+
+                    except IOError:
+                        # It just went away, try again after the delay
+                        lock_owner = None
+
+                    if lock_owner is not None and time.time() < deadline:
+                        hint = ("Waiting for the lock held by %(user)s "
+                                "(cmd: '%(cmd)s', pid: %(pid)s)..."
+                                % lock_owner)
+                        self.instance.base.logger.log_progress(
+                                {"current": 0, "total": 1, "hint": hint})
+
+                if time.time() >= deadline:
+                    msg = "The package system is being used by another " \
+                          "administrator - please try again later"
+
+                    if lock_owner is not None:
+                        msg += " (user: %(user)s, cmd: '%(cmd)s', " \
+                               "pid: %(pid)s)" % lock_owner
+
+                    raise NBYumException(msg)
+
+                time.sleep(max(0, min(delay, deadline - time.time())))
+                delay = min(delay * 2, LOCK_POLL_MAX)
+
+        finally:
+            if queue is not None:
+                queue.leave()
+
+    def __try_lock(self):
+        """Try acquiring the Yum lock
+
+        Return the pid of the process holding it, or None if we got it.
+        """
+        # Importing Yum is expensive, only do it when we need it
+        from yum.Errors import LockError
+
         try:
             self.instance.base.doLock()
 
@@ -62,14 +221,9 @@ class locked(object):
                 locking_pid = int(e.pid)
 
                 if locking_pid != os.getpid():
-                    lock_owner = self.__get_lock_owner(locking_pid)
-
-                    msg = ("The package system is being used by another " \
-                           "administrator - please try again later (user: " \
-                           "%(user)s, cmd: '%(cmd)s', pid: %(pid)s)"
-                           % lock_owner)
+                    return locking_pid
 
-                    raise NBYumException(msg)
+        return None
 
     def __get_lock_owner(self, locking_pid):
         """Figure out the some info on the locking process"""
@@ -103,11 +257,85 @@ class locked(object):
         self.instance.base.doUnlock()
 
 
-def get_parser():
+class FieldsType(object):
+    """Parse a comma-separated list of package fields, e.g 'name,version'."""
+    def __init__(self, choices):
+        self.choices = choices
+
+    def __call__(self, value):
+        fields = [field.strip() for field in value.split(",") if field.strip()]
+
+        if not fields:
+            raise argparse.ArgumentTypeError("no field specified")
+
+        unknown = [field for field in fields if field not in self.choices]
+
+        if unknown:
+            raise argparse.ArgumentTypeError("unknown field(s): %s (choose "
+                                             "from %s)"
+                                             % (", ".join(unknown),
+                                                ", ".join(self.choices)))
+
+        return tuple(fields)
+
+
+def flush_policy(value):
+    """Parse a flush policy: 'line', 'time:SECONDS' or 'size:BYTES'."""
+    policy, sep, arg = value.partition(":")
+
+    try:
+        if policy == "line" and not sep:
+            return ("line", None)
+
+        elif policy == "time":
+            return ("time", float(arg))
+
+        elif policy == "size":
+            return ("size", int(arg))
+
+    except ValueError:
+        pass
+
+    raise argparse.ArgumentTypeError("invalid flush policy: %s (use 'line', "
+                                     "'time:SECONDS' or 'size:BYTES')"
+                                     % value)
+
+
+class NBYumArgumentParser(argparse.ArgumentParser):
+    """An argument parser which doesn't exit on errors.
+
+    This is used to parse the requests when serving several of them from a
+    single process, where a bad request must not take the whole thing down.
+    """
+    def error(self, message):
+        raise NBYumException(message)
+
+    def exit(self, status=0, message=None):
+        raise ParserExit(status, message)
+
+    def print_help(self, file=None):
+        self.__print(self.format_help(), file)
+
+    def print_usage(self, file=None):
+        self.__print(self.format_usage(), file)
+
+    def __print(self, message, file):
+        """Print to the client rather than to our own standard output."""
+        if file is not None:
+            file.write(message)
+            return
+
+        # The output module needs this one, so we can't import it earlier
+        from .output import get_emitter
+
+        get_emitter().emit({"type": "log", "info": message.rstrip()})
+
+
+def get_parser(parser_class=argparse.ArgumentParser):
     """Get the argument parser for the main nbyum command line tool."""
     # -- Root level arguments (-h/--help is added by default) ----------------
-    parser = argparse.ArgumentParser(description="Just like yum, "
-                                                 "but with a usable output")
+    parser = parser_class(description="Just like yum, "
+                                      "but with a usable output")
     parser.add_argument("-d", "--debug", action="store_true",
                         help="Print some useful debug information")
     parser.add_argument("-c", "--config",
@@ -116,9 +344,50 @@ def get_parser():
     parser.add_argument("--force-cache", action="store_true",
                         help="Force Yum to use its local cache, as old as it "
                              "may be.")
+    parser.add_argument("--download-workers", type=int, metavar="N",
+                        help="Download up to N packages at the same time "
+                             "from each repository (default: as configured "
+                             "for Yum)")
+    parser.add_argument("--flush", type=flush_policy, default=("line", None),
+                        metavar="POLICY",
+                        help="When to flush the output: 'line' after each "
+                             "line (the default), 'time:SECONDS' or "
+                             "'size:BYTES'")
+    parser.add_argument("--coalesce-progress", type=float, default=0,
+                        metavar="SECONDS",
+                        help="Only print the latest progress line within "
+                             "this many seconds (default: 0, print all of "
+                             "them)")
+    parser.add_argument("--max-cache-age", type=int, default=3600,
+                        metavar="SECONDS",
+                        help="Don't download the package metadata if "
+                             "'nbyum refresh' fetched it less than this many "
+                             "seconds ago (default: 3600, 0 to always check "
+                             "the repositories)")
+    parser.add_argument("--wait-lock", type=float, default=0,
+                        metavar="SECONDS",
+                        help="Wait for that many seconds if the package "
+                             "system is in use, rather than failing "
+                             "immediately (default: 0)")
+    parser.add_argument("--timings", action="store_true",
+                        help="Print how long each stage of the command took")
+    parser.add_argument("--trace", metavar="FILE",
+                        help="Record a trace of the command in FILE, in the "
+                             "Chrome trace event format")
+    parser.add_argument("--trace-profile", action="store_true",
+                        help="Along with --trace, profile the command and "
+                             "write the statistics in FILE.prof")
 
     subparsers = parser.add_subparsers(title="subcommands")
 
+    # -- Subcommand: batch ---------------------------------------------------
+    parser_batch = subparsers.add_parser("batch",
+                                         help="Run several commands read "
+                                              "from the standard input, one "
+                                              "per line, loading the package "
+                                              "metadata only once")
+    parser_batch.set_defaults(func="batch")
+
     # -- Subcommand: check-update --------------------------------------------
     parser_checkupdate = subparsers.add_parser("check-update",
                                                help="Check for updates to "
@@ -131,12 +400,29 @@ def get_parser():
                                          "checked.")
     parser_checkupdate.set_defaults(func="check_update")
 
+    # -- Subcommand: commit --------------------------------------------------
+    parser_commit = subparsers.add_parser("commit",
+                                          help="Apply a transaction planned "
+                                               "with the --plan option")
+    parser_commit.add_argument("token", metavar="TOKEN",
+                               help="The token of the plan, as printed in "
+                                    "the recap")
+    parser_commit.set_defaults(func="commit")
+
     # -- Subcommand: info ----------------------------------------------------
     parser_info = subparsers.add_parser("info",
                                         help="Get some infos about packages")
     parser_info.add_argument("patterns", nargs="+", metavar="PATTERN",
                              help="A (list of) glob-like pattern(s) to match "
                                   "names against, for example 'nb*'.")
+    parser_info.add_argument("--stream", action="store_true", default=False,
+                             help="Print each package as soon as it is ready,"
+                                  " on its own line")
+    parser_info.add_argument("--fields", type=FieldsType(INFO_FIELDS),
+                             default=INFO_FIELDS, metavar="FIELD[,FIELD...]",
+                             help="Only print these attributes of the "
+                                  "packages (default: %s)"
+                                  % ",".join(INFO_FIELDS))
     parser_info.set_defaults(func="info")
 
     # -- Subcommand: install -------------------------------------------------
@@ -152,6 +438,14 @@ def get_parser():
     parser_install.add_argument("patterns", nargs="+", metavar="PATTERN",
                                 help="A (list of) glob-like pattern(s) to "
                                      "match names against, for example 'nb*'.")
+    parser_install.add_argument("--download-only", action="store_true",
+                                default=False,
+                                help="Only download the packages, so that "
+                                     "a later installation doesn't have to")
+    parser_install.add_argument("--plan", action="store_true", default=False,
+                                help="Resolve and save the transaction "
+                                     "without applying it, to commit it "
+                                     "later")
     parser_install.set_defaults(func="install")
 
     # -- Subcommand: last-updated --------------------------------------------
@@ -180,6 +474,15 @@ def get_parser():
     parser_list.add_argument("--show-hidden", action="store_true",
                              default=False,
                              help="Also show the hidden security modules")
+    parser_list.add_argument("--stream", action="store_true", default=False,
+                             help="Print each package as soon as it is ready,"
+                                  " on its own line")
+    parser_list.add_argument("--fields", type=FieldsType(LIST_FIELD_CHOICES),
+                             default=LIST_FIELDS, metavar="FIELD[,FIELD...]",
+                             help="Only print these attributes of the "
+                                  "packages, among %s (default: %s)"
+                                  % (",".join(LIST_FIELD_CHOICES),
+                                     ",".join(LIST_FIELDS)))
     parser_list.set_defaults(func="list")
 
     # -- Subcommand: rebuild-cache -------------------------------------------
@@ -187,6 +490,13 @@ def get_parser():
                                          help="Clean and rebuild the cache")
     parser_cache.set_defaults(func="rebuild_cache")
 
+    # -- Subcommand: refresh -------------------------------------------------
+    parser_refresh = subparsers.add_parser("refresh",
+                                           help="Download fresh package "
+                                                "metadata, without getting "
+                                                "in the way of other commands")
+    parser_refresh.set_defaults(func="refresh")
+
     # -- Subcommand: remove --------------------------------------------------
     parser_remove = subparsers.add_parser("remove",
                                           help="Remove installed packages and"
@@ -200,8 +510,32 @@ def get_parser():
     parser_remove.add_argument("patterns", nargs="+", metavar="PATTERN",
                                help="A (list of) glob-like pattern(s) to "
                                     "match names against, for example 'nb*'.")
+    parser_remove.add_argument("--plan", action="store_true", default=False,
+                               help="Resolve and save the transaction without "
+                                    "applying it, to commit it later")
     parser_remove.set_defaults(func="remove")
 
+    # -- Subcommand: serve ---------------------------------------------------
+    parser_serve = subparsers.add_parser("serve",
+                                         help="Serve requests on a Unix "
+                                              "socket, keeping the package "
+                                              "metadata loaded in memory")
+    parser_serve.add_argument("--socket", default="/var/run/nbyum.sock",
+                              help="The path of the Unix socket to listen "
+                                   "on (default: /var/run/nbyum.sock)")
+    parser_serve.add_argument("--max-age", type=int, default=600,
+                              metavar="SECONDS",
+                              help="Reload the package metadata when it was "
+                                   "loaded more than this many seconds ago "
+                                   "(default: 600)")
+    parser_serve.set_defaults(func="serve")
+
+    # -- Subcommand: stats ---------------------------------------------------
+    parser_stats = subparsers.add_parser("stats",
+                                         help="Get statistics about the "
+                                              "previous invocations")
+    parser_stats.set_defaults(func="stats")
+
     # -- Subcommand: update --------------------------------------------------
     parser_update = subparsers.add_parser("update",
                                           help="Update packages or the whole "
@@ -211,6 +545,13 @@ def get_parser():
                                     "names against, for example 'nb*'. If "
                                     "none is specified, the whole system is "
                                     "updated.")
+    parser_update.add_argument("--download-only", action="store_true",
+                               default=False,
+                               help="Only download the packages, so that a "
+                                    "later update doesn't have to")
+    parser_update.add_argument("--plan", action="store_true", default=False,
+                               help="Resolve and save the transaction without "
+                                    "applying it, to commit it later")
     parser_update.set_defaults(func="update")
 
     return parser
@@ -222,6 +563,23 @@ def get_version(pkg):
     else:
         return "%s-%s" % (pkg.version, pkg.release)
 
+def get_pkgdict(pkg, fields):
+    """Get the requested attributes of a package.
+
+    Only those are ever read, as some of them (e.g the description) might be
+    expensive to load.
+    """
+    pkgdict = {}
+
+    for field in fields:
+        if field == "version":
+            pkgdict[field] = get_version(pkg)
+
+        else:
+            pkgdict[field] = getattr(pkg, field)
+
+    return pkgdict
+
 def list_ordergetter(pkg):
     """Return a simple ordering for package lists.
 
@@ -239,6 +597,35 @@ def list_ordergetter(pkg):
 
     return "%(name)s-%(epoch)s:%(version)s-%(release)s.%(arch)s" % envra
 
+def dedupe_multiarch(pkgs, basearch):
+    """Filter multiarch dupes for arches others than the system one.
+
+    Packages must be ordered by nevra, so that we can just compare each one
+    with the previous one we kept. This works as a stream, so that we only
+    ever keep one package around.
+    """
+    previous = None
+
+    for pkg in pkgs:
+        if previous is not None and previous.name == pkg.name and \
+           get_version(previous) == get_version(pkg):
+            # This is a multiarch dupe
+
+            if previous.arch == basearch and pkg.arch != basearch:
+                continue
+
+            elif previous.arch != basearch and pkg.arch == basearch:
+                previous = pkg
+                continue
+
+        if previous is not None:
+            yield previous
+
+        previous = pkg
+
+    if previous is not None:
+        yield previous
+
 def transaction_ordergetter(pkg):
     """Return a simple ordering for package lists.
 
@@ -1,17 +1,213 @@
-import fnmatch
+import errno
+import hashlib
 from itertools import groupby, ifilter
+import json
 from operator import attrgetter
 import os
+import re
+import shutil
+import time
 
+from rpmUtils.miscutils import compareEVR
 import yum
-from yum.update_md import UpdateMetadata
+import yum.misc
+from yum.Errors import YumBaseError
+from yum.sqlutils import sqlite
 
+from .catalog import (InstalledSet, PackageCatalog, best_packages,
+                      get_rpmdb_cookie, open_catalog, write_catalog)
 from .errors import NBYumException, WTFException
+from .history import (UPDATE_STATES, get_max_tid, query_last_updated,
+                      read_last_update_stamp, write_last_update_stamp)
 from .logging_hijack import NBYumRPMCallback
-from .utils import get_version, list_ordergetter, transaction_ordergetter
+from .metrics import count, stage
+from .output import NBYumEmitter, get_emitter, recap_packages, set_emitter
+from .patterns import PatternMatcher, sanitize_patterns
+from .snapshot import get_current_snapshot, publish_snapshot
+from .utils import (INFO_FIELDS, LIST_FIELDS, get_version,
+                    transaction_ordergetter)
+
+
+# What can go wrong when querying the history database directly
+HISTORY_ERRORS = (AttributeError, sqlite.Error)
+
+# What the tokens of saved plans look like
+PLAN_TOKEN_RE = re.compile("^[0-9a-f]{32}$")
+
+# Plans which were not committed after that many seconds are thrown away
+PLAN_MAX_AGE = 24 * 3600
+
+# How many repositories we fetch the metadata of at the same time
+METADATA_PREFETCH_WORKERS = 8
+
+
+def _prefetch_repo_metadata(repo, extra=(), complete=False):
+    """Fetch the metadata of a repository we will need for the sacks.
+
+    The `extra` metadata types are fetched as well, if the repository has
+    them. With `complete`, fetch all of its metadata instead, e.g the file
+    lists or the groups, which Yum would otherwise only fetch on first use.
+    """
+    data = repo.repoXML.repoData
+
+    if complete:
+        # Yum prefers the databases and the compressed groups
+        mdtypes = [mdtype for mdtype in sorted(data)
+                   if "%s_db" % mdtype not in data and
+                      "%s_gz" % mdtype not in data]
+
+    elif "primary_db" in data:
+        mdtypes = ["primary_db"]
+    else:
+        mdtypes = ["primary"]
+
+    if not complete:
+        mdtypes.extend([mdtype for mdtype in extra if mdtype in data])
+
+    for mdtype in mdtypes:
+        path = repo.retrieveMD(mdtype)
+
+        if mdtype.endswith("_db") and path:
+            # Yum would decompress it anyway when building the sacks
+            yum.misc.decompress(path)
+
+def _fork_prefetch(repo, extra=(), complete=False):
+    """Fetch the metadata of a repository in a child process.
+
+    urlgrabber shares a single curl handle and our progress meters between
+    all its users, so each repository gets a process of its own rather than
+    a thread. What it fetches ends up in the cache, where Yum finds it.
+
+    Return the pid of the child, and a pipe it writes its error to, if any.
+    """
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+
+    if pid:
+        os.close(wfd)
+        return pid, rfd
+
+    try:
+        try:
+            os.close(rfd)
+
+            # Our parent prints the progress, and must not get our output
+            set_emitter(NBYumEmitter(open(os.devnull, "w")))
+
+            from urlgrabber.grabber import reset_curl_obj
+            reset_curl_obj()
+
+            _prefetch_repo_metadata(repo, extra=extra, complete=complete)
+
+        except Exception, e:
+            os.write(wfd, str(e) or e.__class__.__name__)
+
+    finally:
+        # Don't run any of the exit handlers of our parent, e.g the trace
+        os._exit(0)
+
+def _wait_prefetch(pid, rfd):
+    """Wait for a child started by _fork_prefetch().
+
+    Return the error it reported, if any.
+    """
+    chunks = []
+
+    try:
+        while True:
+            chunk = os.read(rfd, 4096)
+
+            if not chunk:
+                break
+
+            chunks.append(chunk)
+
+    finally:
+        os.close(rfd)
+
+    unused, status = os.waitpid(pid, 0)
+
+    if chunks:
+        return "".join(chunks)
+
+    if status:
+        return "The download process died with status %d" % status
+
+
+def _is_downloaded(po):
+    """Whether a package was already fully downloaded.
+
+    This only compares sizes, so that partial downloads are not counted:
+    Yum checksums the packages anyway when it downloads them.
+    """
+    try:
+        return os.path.getsize(po.localPkg()) == int(po.size)
+
+    except OSError:
+        return False
 
 
 class NBYumBase(yum.YumBase):
+    # The catalog of available packages, see __update_catalog()
+    __catalog = None
+
+    # The snapshot of installed packages, see __get_installed_snapshot()
+    __installed_snapshot = None
+
+    # The installed packages, see installed_set
+    __installed_set = None
+
+    # The update notices, see updatemd
+    __updatemd = None
+
+    # The notices suggesting a reboot, see __index_reboot_notices()
+    __reboot_index = None
+
+    # Those which apply to the transaction that ran, see processTransaction()
+    __transaction_reboot_notices = None
+
+    # Whether we told the user about downloading the package metadata
+    __downloading_logged = False
+
+    # The metadata types to prefetch besides the sacks, see prepare()
+    __prefetch_extra = ()
+
+    # Where the package downloads report their progress, if anywhere
+    download_progress = None
+
+    @property
+    def __catalog_path(self):
+        return os.path.join(self.conf.cachedir, "nbyum", "available.catalog")
+
+    @property
+    def __installed_snapshot_path(self):
+        return os.path.join(self.conf.persistdir, "nbyum",
+                            "installed.catalog")
+
+    @property
+    def __snapshots_dir(self):
+        return os.path.join(self.conf.persistdir, "nbyum", "snapshots")
+
+    @property
+    def __last_update_stamp_path(self):
+        return os.path.join(self.conf.persistdir, "nbyum", "last-update.json")
+
+    @property
+    def __check_update_cache_path(self):
+        return os.path.join(self.conf.cachedir, "nbyum", "check-update.json")
+
+    @property
+    def __refresh_stamp_path(self):
+        return os.path.join(self.conf.cachedir, "nbyum", "refreshed.json")
+
+    @property
+    def __staging_dir(self):
+        return os.path.join(self.conf.cachedir, "nbyum", "staging")
+
+    @property
+    def __plans_dir(self):
+        return os.path.join(self.conf.persistdir, "nbyum", "plans")
+
     def clean_cache(self):
         """Clean the local cache"""
         self.logger.log_progress({"current": 0, "total": 1,
@@ -32,25 +228,706 @@ class NBYumBase(yum.YumBase):
         run_clean("cleanSqlite", "SQLite metadata")
         run_clean("cleanRpmDB", "RPM DB")
 
+        for path in (self.__catalog_path, self.__installed_snapshot_path,
+                     self.__check_update_cache_path,
+                     self.__last_update_stamp_path,
+                     self.__refresh_stamp_path):
+            try:
+                os.unlink(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    raise NBYumException("Could not clean %s: %s" % (path, e))
+
+        shutil.rmtree(self.__snapshots_dir, ignore_errors=True)
+        shutil.rmtree(self.__plans_dir, ignore_errors=True)
+        shutil.rmtree(self.__staging_dir, ignore_errors=True)
+
         self.plugins.run('clean')
 
-    def prepare(self):
+    def prepare(self, needs=("sacks", "updateinfo")):
         """Prepare for the user's request
 
-        This implies getting the various repository metadata.
+        This implies getting the repository metadata the request `needs`,
+        among:
+            - "catalog": the catalog of available packages, rebuilt from the
+              sacks if it is out of date;
+            - "sacks": the package metadata;
+            - "updateinfo": the update notices.
+
+        Anything else is loaded on first use.
         """
         self.setCacheDir()
 
-        if not self.conf.cache:
+        if "updateinfo" in needs:
+            # Fetch the update notices along with the rest
+            self.__prefetch_extra = ("updateinfo", )
+
+        if "sacks" in needs:
+            self._getSacks()
+
+        if "catalog" in needs:
+            self.__log_downloading()
+            self.__update_catalog()
+
+        if "updateinfo" in needs:
+            self.updatemd
+
+    def __log_downloading(self):
+        """Let the user know we might be downloading the package metadata."""
+        if self.conf.cache or self.__downloading_logged:
             # If we force the cache usage, the next operation will not imply a
             # download, so don't log in that case
-            self.logger.log_progress({"current": 0, "total": 1,
-                                      "hint": "Downloading the package "
-                                              "metadata..."})
+            return
+
+        self.logger.log_progress({"current": 0, "total": 1,
+                                  "hint": "Downloading the package "
+                                          "metadata..."})
+        self.__downloading_logged = True
+
+    def _getSacks(self, archlist=None, thisrepo=None):
+        """Load the package metadata."""
+        if self._pkgSack is not None and thisrepo is None:
+            return self._pkgSack
+
+        with stage("metadata"):
+            self.__log_downloading()
+
+            if thisrepo is None:
+                self.__prefetch_metadata(extra=self.__prefetch_extra)
+
+            sack = yum.YumBase._getSacks(self, archlist=archlist,
+                                         thisrepo=thisrepo)
+
+        return sack
+
+    def __prefetch_metadata(self, extra=(), complete=False):
+        """Fetch the metadata of all enabled repositories concurrently.
+
+        Otherwise Yum fetches them one after the other when building the
+        sacks, so that we wait for the sum of all their latencies.
+
+        Each repository reports a progress line once it is ready, in the
+        order of the repositories, so the output is deterministic.
+
+        Errors are left for Yum to deal with (e.g skip_if_unavailable) when
+        it builds the sacks.
+
+        See _prefetch_repo_metadata() for the meaning of `extra` and
+        `complete`.
+
+        Return the errors which happened, by repository id.
+        """
+        errors = {}
+
+        if self.conf.cache:
+            # Nothing to download anyway
+            return errors
+
+        if not getattr(self.repos, "_setup", False):
+            self.repos.doSetup()
+
+        repos = self.repos.listEnabled()
+
+        if not repos:
+            return errors
+
+        # Whatever our children print must come after what we already printed
+        get_emitter().flush()
+
+        running = []
+        done = 0
+
+        try:
+            for repo in repos:
+                running.append((repo, _fork_prefetch(repo, extra=extra,
+                                                     complete=complete)))
+
+                while len(running) >= METADATA_PREFETCH_WORKERS or \
+                      (running and len(running) + done == len(repos)):
+                    repo, child = running.pop(0)
+                    error = _wait_prefetch(*child)
+                    done += 1
+
+                    if error is not None:
+                        errors[repo.id] = error
+                        self.verbose_logger.debug("Could not prefetch the "
+                                                  "metadata of %s: %s"
+                                                  % (repo.id, error))
+
+                    self.logger.log_progress({"current": done,
+                                              "total": len(repos),
+                                              "hint": "Fetched the metadata "
+                                                      "of %s" % repo.id})
+
+        finally:
+            # e.g when interrupted, don't leave zombies behind
+            for repo, child in running:
+                _wait_prefetch(*child)
+
+        return errors
+
+    def stage_metadata(self):
+        """Download fresh metadata of the enabled repositories.
+
+        Each repository gets a staging copy of its cache, so that only what
+        changed is downloaded, and so that nobody sees it until it is swapped
+        in place by swap_metadata().
+
+        All the metadata is staged, not only what the sacks need: the live
+        copies of the rest would not match the new repomd.xml any more.
+
+        This must run on a fresh base, before anything set the repositories
+        up with their live cache.
+
+        Return the staging and live cache directories of the repositories
+        which were successfully refreshed, by repository id.
+        """
+        shutil.rmtree(self.__staging_dir, ignore_errors=True)
+        os.makedirs(self.__staging_dir)
+
+        dirs = {}
+
+        for repo in self.repos.listEnabled():
+            live = os.path.join(repo.basecachedir, repo.id)
+            staging = os.path.join(self.__staging_dir, repo.id)
+
+            if os.path.isdir(live):
+                shutil.copytree(live, staging,
+                                ignore=shutil.ignore_patterns("packages",
+                                                              "headers"))
+
+            dirs[repo.id] = (staging, live)
+
+            # Always check whether the repository changed
+            repo.metadata_expire = 0
+
+        self.repos.setCacheDir(self.__staging_dir)
+
+        self.__log_downloading()
+        errors = self.__prefetch_metadata(complete=True)
+
+        for repoid, error in sorted(errors.items()):
+            self.logger.warning("Could not refresh the metadata of %s: %s"
+                                % (repoid, error))
+            del dirs[repoid]
+
+        return dirs
+
+    def swap_metadata(self, dirs):
+        """Swap the staged metadata in place of the live one.
+
+        `dirs` is what stage_metadata() returned. This must be called under
+        the Yum lock, so that Yum only ever sees one or the other.
+        """
+        for repoid, (staging, live) in sorted(dirs.items()):
+            # Keep the packages we already downloaded
+            for name in ("packages", "headers"):
+                src = os.path.join(live, name)
+                dest = os.path.join(staging, name)
+
+                if os.path.isdir(src):
+                    shutil.rmtree(dest, ignore_errors=True)
+                    os.rename(src, dest)
+
+            old = "%s.old.%d" % (live, os.getpid())
+
+            if os.path.isdir(live):
+                os.rename(live, old)
+
+            os.rename(staging, live)
+            shutil.rmtree(old, ignore_errors=True)
+
+        stamp = {"time": time.time(), "repos": sorted(dirs)}
+
+        with open(self.__refresh_stamp_path, "w") as f:
+            json.dump(stamp, f)
+
+    def is_metadata_fresh(self, max_age):
+        """Whether the metadata was refreshed recently enough.
+
+        That is, whether `nbyum refresh' fetched the metadata of all the
+        enabled repositories less than `max_age` seconds ago.
+        """
+        try:
+            with open(self.__refresh_stamp_path) as f:
+                stamp = json.load(f)
+
+            age = time.time() - stamp["time"]
+            refreshed = stamp["repos"]
+
+        except (IOError, ValueError, KeyError, TypeError):
+            return False
+
+        if not 0 <= age < max_age:
+            return False
+
+        for repo in self.repos.listEnabled():
+            if repo.id not in refreshed:
+                return False
+
+        return True
+
+    @property
+    def updatemd(self):
+        """The update notices, loaded on first use."""
+        if self.__updatemd is None:
+            from yum.update_md import UpdateMetadata
+
+            with stage("updateinfo"):
+                updatemd = UpdateMetadata(self.repos.listEnabled())
+                self.__reboot_index = self.__index_reboot_notices(updatemd)
+
+            self.__updatemd = updatemd
+
+        return self.__updatemd
+
+    def __index_reboot_notices(self, updatemd):
+        """Index the update notices suggesting a reboot.
+
+        The result maps (name, arch) to the list of (evr, update_id) from
+        those notices, the newest evr first.
+        """
+        index = {}
+
+        for notice in updatemd.notices:
+            if not notice["reboot_suggested"]:
+                continue
+
+            for collection in notice["pkglist"]:
+                for pkg in collection["packages"]:
+                    evr = (pkg["epoch"] or "0", pkg["version"], pkg["release"])
+                    index.setdefault((pkg["name"], pkg["arch"]), []).append(
+                            (evr, notice["update_id"]))
+
+        for notices in index.values():
+            notices.sort(cmp=lambda x, y: compareEVR(y[0], x[0]))
+
+        return index
+
+    def __get_reboot_notices(self, pkgtup):
+        """Get the ids of the notices suggesting a reboot to update pkgtup.
+
+        This is the same as looking for the notices applicable to pkgtup
+        which suggest a reboot, without scanning all the update notices.
+        """
+        self.updatemd
+        result = []
+
+        name, arch, epoch, version, release = pkgtup
+
+        for evr, update_id in self.__reboot_index.get((name, arch), []):
+            if compareEVR(evr, (epoch or "0", version, release)) <= 0:
+                # Notices are sorted, the next ones won't be newer
+                break
+
+            result.append(update_id)
+
+        return result
+
+    def __get_transaction_reboot_notices(self):
+        """Get the ids of the notices suggesting a reboot for the transaction.
+
+        This must be called while the packages it updates are still installed.
+        """
+        notices = set()
+
+        for member in self.tsInfo.getMembers():
+            # Only updates (install_only ones included) can suggest a reboot,
+            # so the update notices are loaded on the first one, if any
+            if member.ts_state in ("i", "u"):
+                for pkgtup in self.installed_set.search(member.po.name,
+                                                        member.po.arch):
+                    notices.update(self.__get_reboot_notices(pkgtup))
+
+        return notices
+
+    def get_repos_checksums(self):
+        """Get a checksum of the metadata of each enabled repository."""
+        checksums = {}
+
+        for repo in self.repos.listEnabled():
+            data = repo.repoXML.repoData
+            checksum = hashlib.sha1()
+
+            for mdtype in sorted(data):
+                checksum.update("%s:%s\n" % (mdtype, data[mdtype].checksum[1]))
+
+            checksums[repo.id] = checksum.hexdigest()
+
+        return checksums
+
+    def __get_catalog_key(self):
+        """Get what the content of the available packages catalog depends on."""
+        filters = {}
+
+        for repo in self.repos.listEnabled():
+            filters[repo.id] = [sorted(repo.exclude), sorted(repo.includepkgs)]
+
+        return {"repos": self.get_repos_checksums(), "filters": filters,
+                "exclude": sorted(self.conf.exclude),
+                "arch": self.arch.canonarch}
+
+    def __update_catalog(self):
+        """Make sure the catalog of available packages is up to date.
+
+        Listing available packages from the catalog is much faster than
+        instantiating all the packages from the sacks, so we keep it around
+        until the repositories metadata changes.
+        """
+        key = self.__get_catalog_key()
+        catalog = open_catalog(self.__catalog_path, key)
+
+        if catalog is None:
+            try:
+                write_catalog(self.__catalog_path, key,
+                              self.pkgSack.returnPackages())
+
+            except (IOError, OSError), e:
+                self.verbose_logger.debug("Could not write the catalog: %s"
+                                          % e)
+                return
+
+            catalog = open_catalog(self.__catalog_path, key)
+            self.__publish_snapshot()
+
+        elif get_current_snapshot(self.__snapshots_dir) is None:
+            self.__publish_snapshot()
+
+        self.__catalog = catalog
+
+    def __publish_snapshot(self):
+        """Publish what we know of the system for lock-free readers.
+
+        See the nbyum.snapshot module.
+        """
+        try:
+            publish_snapshot(self.__snapshots_dir,
+                             {"installed.catalog":
+                                  self.__installed_snapshot_path,
+                              "available.catalog": self.__catalog_path})
+
+        except (IOError, OSError), e:
+            self.verbose_logger.debug("Could not publish the snapshot: %s"
+                                      % e)
+
+    def get_cached_check_update(self, patterns):
+        """Get the output of a previous check for updates, if still valid.
+
+        The output of a check only depends on the installed packages, the
+        repositories and the patterns, which make the key of the cached
+        output.
+
+        Return the key of the current check, or None if it can't be cached,
+        and the cached output, or None if there is none for this key.
+        """
+        self.setCacheDir()
+        self.__log_downloading()
+
+        try:
+            rpmdb_cookie = get_rpmdb_cookie(self.conf.installroot)
+
+        except OSError, e:
+            self.verbose_logger.debug("Could not find the rpmdb: %s" % e)
+            return None, None
+
+        key = {"rpmdb": rpmdb_cookie, "patterns": sorted(patterns),
+               "repos": self.__get_catalog_key()}
+
+        try:
+            with open(self.__check_update_cache_path) as f:
+                cached = json.load(f)
+
+        except (IOError, ValueError):
+            return key, None
+
+        if not isinstance(cached, dict) or cached.get("key") != key:
+            return key, None
+
+        return key, cached.get("output")
+
+    def cache_check_update(self, key, output):
+        """Keep the output of a check for updates, for the next ones."""
+        path = self.__check_update_cache_path
+        tmp_path = "%s.%s.tmp" % (path, os.getpid())
+
+        try:
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+
+            with open(tmp_path, "w") as f:
+                json.dump({"key": key, "output": output}, f)
+
+            os.rename(tmp_path, path)
+
+        except (IOError, OSError), e:
+            self.verbose_logger.debug("Could not cache the check for "
+                                      "updates: %s" % e)
+
+    def __get_installed_snapshot(self, refresh=False):
+        """Get the snapshot of installed packages, updating it if needed.
+
+        The rpmdb almost never changes, and reading the snapshot is much
+        cheaper than querying it, so we keep the snapshot around until the
+        rpmdb cookie changes.
+
+        Return None if the snapshot can't be used.
+        """
+        try:
+            # Get the cookie first, so that if the rpmdb changes while we
+            # read it the snapshot will just be considered out of date
+            key = {"rpmdb": get_rpmdb_cookie(self.conf.installroot)}
+
+        except OSError, e:
+            self.verbose_logger.debug("Could not find the rpmdb: %s" % e)
+            return None
+
+        snapshot = self.__installed_snapshot
+
+        if refresh or snapshot is None or snapshot.key != key:
+            snapshot = None
+
+            if not refresh:
+                snapshot = open_catalog(self.__installed_snapshot_path, key)
+
+            if snapshot is None:
+                try:
+                    write_catalog(self.__installed_snapshot_path, key,
+                                  self.rpmdb.returnPackages())
+
+                except (IOError, OSError), e:
+                    self.verbose_logger.debug("Could not write the installed "
+                                              "packages snapshot: %s" % e)
+                    return None
+
+                snapshot = open_catalog(self.__installed_snapshot_path, key)
+                self.__publish_snapshot()
+
+            self.__installed_snapshot = snapshot
+
+        return snapshot
+
+    @property
+    def installed_set(self):
+        """The installed packages, for quick "is this installed?" answers.
+
+        This is built only once, from the installed packages snapshot when
+        possible, rather than querying the rpmdb for each package.
+        """
+        if self.__installed_set is None:
+            source = self.__get_installed_snapshot()
+
+            if source is None:
+                source = self.rpmdb
+
+            self.__installed_set = InstalledSet(source.simplePkgList())
+
+        return self.__installed_set
+
+    def closeRpmDB(self):
+        """Close the rpmdb, forgetting what we knew about it."""
+        yum.YumBase.closeRpmDB(self)
+
+        self.__installed_set = None
+
+    @stage("depsolve")
+    def buildTransaction(self, *args, **kwargs):
+        """Resolve the dependencies of the transaction."""
+        return yum.YumBase.buildTransaction(self, *args, **kwargs)
+
+    @stage("transaction")
+    def processTransaction(self, *args, **kwargs):
+        """Process the transaction, then snapshot what changed."""
+        count("transaction_size", len(self.tsInfo))
 
-        self._getSacks()
+        # Once the transaction ran, the packages it updates are gone
+        self.__transaction_reboot_notices = \
+                self.__get_transaction_reboot_notices()
+
+        result = yum.YumBase.processTransaction(self, *args, **kwargs)
+
+        self.rpmdb.dropCachedData()
+        self.__get_installed_snapshot(refresh=True)
+        self.__installed_set = None
+
+        # The history has a new transaction now
+        self.__update_last_update_stamp()
+
+        return result
+
+    @stage("verify")
+    def verifyTransaction(self, *args, **kwargs):
+        """Verify the packages after the transaction ran."""
+        return yum.YumBase.verifyTransaction(self, *args, **kwargs)
+
+    @stage("download")
+    def downloadPkgs(self, pkglist, callback=None, callback_total=None):
+        """Download packages, reporting the overall progress."""
+        remote_pkgs = [po for po in pkglist if not _is_downloaded(po)]
+
+        staged = len(pkglist) - len(remote_pkgs)
+
+        if staged:
+            # e.g downloaded by a previous run with --download-only
+            self.verbose_logger.debug("Using %d already downloaded package%s."
+                                      % (staged, staged>1 and "s" or ""))
+
+        if self.download_progress is not None:
+            self.download_progress.start(len(remote_pkgs),
+                                         sum([int(po.size)
+                                              for po in remote_pkgs]))
+
+        return yum.YumBase.downloadPkgs(self, pkglist, callback=callback,
+                                        callback_total=callback_total)
+
+    def __download_transaction(self):
+        """Download the packages of the transaction, without running it.
+
+        They stay in the Yum cache, where the next run of the same command
+        finds them, so that it can go straight to the transaction.
+        """
+        pkgs = [member.po for member in self.tsInfo.getMembers()
+                if member.ts_state in ("i", "u")]
+
+        problems = self.downloadPkgs(pkgs)
+
+        if problems:
+            errors = []
+
+            for key in sorted(problems):
+                errors.extend(problems[key])
+
+            raise NBYumException("Could not download the packages:\n  - %s"
+                                 % "\n  - ".join([str(e) for e in errors]))
+
+        self.__cleanup_transaction_file()
+        self.verbose_logger.info("Downloaded %d package%s, ready to be "
+                                 "installed." % (len(pkgs),
+                                                 len(pkgs)>1 and "s" or ""))
+
+    def __get_rpmdb_version(self):
+        return str(self.rpmdb.simpleVersion(main_only=True)[0])
+
+    def __get_plan_paths(self, token):
+        """Get the paths of the transaction and metadata of a plan."""
+        if not PLAN_TOKEN_RE.match(token):
+            raise NBYumException("Invalid plan token: %s" % token)
+
+        path = os.path.join(self.__plans_dir, token)
+
+        return "%s.yumtx" % path, "%s.json" % path
+
+    def __remove_plan(self, token):
+        for path in self.__get_plan_paths(token):
+            try:
+                os.unlink(path)
+            except OSError, e:
+                if e.errno != errno.ENOENT:
+                    self.verbose_logger.warning("Could not remove %s: %s"
+                                                % (path, e))
+
+    def save_plan(self, command):
+        """Save the resolved transaction, to commit it later.
+
+        Along with it, we save the rpmdb version and the repositories
+        checksums it was resolved against, so that we know when it is out of
+        date.
+
+        Return the token identifying the plan.
+        """
+        # uuid loads libuuid through ctypes, only do it when planning
+        import uuid
+
+        token = uuid.uuid4().hex
+        ts_path, meta_path = self.__get_plan_paths(token)
+        rpmdb_version = self.__get_rpmdb_version()
+
+        if not os.path.isdir(self.__plans_dir):
+            os.makedirs(self.__plans_dir)
+
+        self.__prune_plans(rpmdb_version)
+        self.save_ts(filename=ts_path)
+
+        with open(meta_path, "w") as f:
+            json.dump({"command": command,
+                       "rpmdb": rpmdb_version,
+                       "repos": self.get_repos_checksums()}, f)
+
+        # We have our own copy of the transaction
+        self.__cleanup_transaction_file()
+
+        return token
+
+    def __prune_plans(self, rpmdb_version):
+        """Remove the plans which will never be committed.
+
+        Those are the ones made for other installed packages, and the ones
+        older than PLAN_MAX_AGE, e.g previews nobody acted upon.
+        """
+        now = time.time()
+
+        for filename in os.listdir(self.__plans_dir):
+            token, ext = os.path.splitext(filename)
+
+            if ext != ".json" or not PLAN_TOKEN_RE.match(token):
+                continue
 
-        self.updatemd = UpdateMetadata(self.repos.listEnabled())
+            meta_path = os.path.join(self.__plans_dir, filename)
+
+            try:
+                if now - os.path.getmtime(meta_path) < PLAN_MAX_AGE:
+                    with open(meta_path) as f:
+                        if json.load(f)["rpmdb"] == rpmdb_version:
+                            continue
+
+            except (IOError, OSError, ValueError, KeyError, TypeError):
+                # Gone already, or unusable anyway
+                pass
+
+            self.__remove_plan(token)
+
+    def load_plan(self, token):
+        """Load a saved plan, if it is still up to date.
+
+        Return the command the plan was made for.
+        """
+        ts_path, meta_path = self.__get_plan_paths(token)
+
+        try:
+            with open(meta_path) as f:
+                meta = json.load(f)
+
+        except (IOError, ValueError):
+            raise NBYumException("No such plan: %s" % token)
+
+        if meta["rpmdb"] != self.__get_rpmdb_version() or \
+           meta["repos"] != self.get_repos_checksums():
+            self.__remove_plan(token)
+            raise NBYumException("The installed packages or the repositories "
+                                 "changed since this plan was made. Please "
+                                 "make a new one.")
+
+        try:
+            self.load_ts(ts_path)
+
+        except YumBaseError, e:
+            self.__remove_plan(token)
+            raise NBYumException("Could not load the plan: %s" % e)
+
+        return meta["command"]
+
+    def commit_plan(self, token):
+        """Run the transaction of a plan loaded with load_plan()."""
+        try:
+            if len(self.tsInfo.getMembers()):
+                # FIXME: We only need the installroot parameter to work around
+                # a Yum bug:
+                #     https://bugzilla.redhat.com/show_bug.cgi?id=684686#c6
+                # When it's fixed, just nuke it out of here
+                self.processTransaction(rpmDisplay=NBYumRPMCallback(
+                        installroot=self.conf.installroot))
+
+        finally:
+            self.__remove_plan(token)
 
     def __cleanup_transaction_file(self):
         """Remove the saved transaction file.
@@ -82,71 +959,58 @@ class NBYumBase(yum.YumBase):
             hidden_filter = lambda x: True
 
         if status == "installed":
-            source = self.rpmdb
+            source = self.__get_installed_snapshot()
+
+            if source is None:
+                source = self.rpmdb
+
+        elif status == "available" and self.__catalog is not None:
+            source = self.__catalog
 
         else:
             source = self.pkgSack
 
-        # match_tuple is (exact_matches, glob_matches, unmatched_patterns)
-        match_tuple = source.matchPackageNames(patterns)
-        matches = set(match_tuple[0] + match_tuple[1])
+        names = PatternMatcher(patterns).filter(self.__get_names(source))
+        if not names:
+            return
+
+        matches = source.searchNames(names)
 
         # Filter on sms or packages
         pkgs = ifilter(type_filter, matches)
 
         if status == "available":
             # Don't show installed packages if we asked for available ones
-            pkgs = ifilter(lambda x: not self.rpmdb.installed(po=x), pkgs)
-
-        def actually_match_on_name(pkg):
-            """Do what matchPackageNames should already be doing
-
-            Yum developers, if you name an API matchPackage**Names**, make it
-            match packages on their name, not envra!
-            """
-            for pattern in patterns:
-                if fnmatch.fnmatch(pkg.name, pattern):
-                    return True
-
-        if patterns != ['*']:
-            pkgs = ifilter(actually_match_on_name, pkgs)
+            installed = self.installed_set.pkgtups
+            pkgs = ifilter(lambda x: x.pkgtup not in installed, pkgs)
 
         # We need to sort before using groupby
         pkgs = sorted(pkgs, key=attrgetter("name"))
 
         for name, group in groupby(pkgs, attrgetter("name")):
-            best = self.bestPackagesFromList(group)
+            if isinstance(source, PackageCatalog):
+                best = best_packages(group, self.arch.archlist)
+
+            else:
+                best = self.bestPackagesFromList(group)
+
             for pkg in best:
                 if hidden_filter(pkg):
                     yield pkg
 
+    def __get_names(self, source):
+        """Get the sorted names of all the packages in a sack or catalog."""
+        if isinstance(source, PackageCatalog):
+            return source.names()
+
+        return sorted(set([pkgtup[0] for pkgtup in source.simplePkgList()]))
+
     def __get_unexpected_sms(self, patterns):
         """List the security modules we didn't expect in the transation"""
-        unexpected = []
-        for pkg in self.tsInfo.getMembers():
-            if pkg.name.startswith("nbsm-"):
-                unexpected.append(pkg.name)
-                for pattern in patterns:
-                    if fnmatch.fnmatch(pkg.name, pattern):
-                        unexpected.remove(pkg.name)
-                        break
-
-        return unexpected
-
-    def __smsize_patterns(self, patterns):
-        """Pre-process patterns when matching security modules.
-
-        If a user specifies a pattern like 'b*', then the 'nbsm-base' security
-        module should match.
-        """
-        result = []
-        for pattern in patterns:
-            if not pattern.startswith("nbsm"):
-                pattern = "nbsm-%s" % pattern
+        matcher = PatternMatcher(patterns)
 
-            result.append(pattern)
-
-        return result
+        return [pkg.name for pkg in self.tsInfo.getMembers()
+                if pkg.name.startswith("nbsm-") and not matcher.match(pkg.name)]
 
     def __hidden_filter(self, pkg):
         return pkg.group != "nbhidden"
@@ -157,50 +1021,39 @@ class NBYumBase(yum.YumBase):
     def __sms_filter(self, pkg):
         return pkg.name.startswith("nbsm-")
 
-    def __sanitize_patterns(self, patterns, type_):
-        """Make sure the patterns are sound."""
-        if not patterns:
-            patterns = ["*"]
+    @stage("recap")
+    def get_infos(self, patterns, fields=INFO_FIELDS, stream=False):
+        """Get some infos on packages."""
+        recap_packages([("pkginfos", self.__get_packages_list(patterns))],
+                       fields, self.arch.basearch, stream=stream)
 
-        if type_ == "sms":
-            # Special case for the security modules
-            patterns = self.__smsize_patterns(patterns)
+    def get_last_updated(self):
+        """Get the timestamp of the last transaction which updated packages.
 
-        return patterns
+        This is answered from a stamp, as long as no transaction happened
+        since it was written. Otherwise we ask the history database.
+        """
+        try:
+            max_tid = get_max_tid(self.__get_history_cursor())
 
-    def get_infos(self, patterns):
-        """Get some infos on packages."""
-        pkgs = []
-        for pkg in sorted(self.__get_packages_list(patterns),
-                          key=list_ordergetter):
-            pkgdict = {"name": pkg.name, "arch": pkg.arch,
-                       "version": get_version(pkg), "license": pkg.license,
-                       "summary": pkg.summary, "description": pkg.description,
-                       "base_package_name": pkg.base_package_name,
-                       }
-
-            # Filter multiarch dupes for arches others than the system one.
-            # We can just compare with the previous one because packages
-            # are ordered by nevra.
-            if len(pkgs) and \
-               pkgs[-1].get("name", None) == pkgdict["name"] and \
-               pkgs[-1].get("version", None) == pkgdict["version"]:
-                # This is a multiarch dupe
-
-                if pkgs[-1]["arch"] == self.arch.basearch and \
-                   pkg.arch != self.arch.basearch:
-                    continue
+        except HISTORY_ERRORS, e:
+            self.verbose_logger.debug("Could not query the history: %s" % e)
+            return self.__scan_last_updated()
 
-                elif pkgs[-1]["arch"] != self.arch.basearch and \
-                     pkg.arch == self.arch.basearch:
-                    pkgs.pop()
+        valid, last_update = read_last_update_stamp(
+                self.__last_update_stamp_path, max_tid)
 
-            pkgs.append(pkgdict)
+        if valid:
+            return last_update
 
-        if pkgs:
-            self.logger.log_recap({"pkginfos": pkgs})
+        return self.__update_last_update_stamp(max_tid)
 
-    def get_last_updated(self):
+    def __get_history_cursor(self):
+        # Yum doesn't have any API for what we need
+        return self.history._get_cursor()
+
+    def __scan_last_updated(self):
+        """Look for the last update, the slow way."""
         # Transactions seem to already be ordered reverse-chronologically, but
         # who knows if we can depend on that :x
         old_tx = sorted(self.history.old([], complete_transactions_only=True),
@@ -209,17 +1062,49 @@ class NBYumBase(yum.YumBase):
         for tx in old_tx:
             for pkg in tx.trans_data:
                 # Search for at least one package having been updated
-                if pkg.state not in ("Update", "Obsoleted", "Install"):
+                if pkg.state not in UPDATE_STATES:
                     continue
 
                 return tx.end_timestamp
 
-    def install_packages(self, type_, patterns):
+    def __update_last_update_stamp(self, max_tid=None):
+        """Write the last update stamp, and return the last update."""
+        try:
+            cursor = self.__get_history_cursor()
+
+            if max_tid is None:
+                max_tid = get_max_tid(cursor)
+
+            last_update = query_last_updated(cursor)
+
+        except HISTORY_ERRORS, e:
+            self.verbose_logger.debug("Could not query the history: %s" % e)
+            return self.__scan_last_updated()
+
+        try:
+            write_last_update_stamp(self.__last_update_stamp_path, max_tid,
+                                    last_update)
+
+        except (IOError, OSError), e:
+            self.verbose_logger.debug("Could not write the last update "
+                                      "stamp: %s" % e)
+
+        return last_update
+
+    def install_packages(self, type_, patterns, download_only=False,
+                         plan=False):
         """Install packages and security modules."""
-        patterns = self.__sanitize_patterns(patterns, type_)
+        patterns = sanitize_patterns(patterns, type_)
 
-        for pattern in patterns:
-            # FIXME: What if a pattern matches `nbsm-*' and type is `packages'?
+        # FIXME: What if a pattern matches `nbsm-*' and type is `packages'?
+        matcher = PatternMatcher(patterns)
+        matched = matcher.filter(self.__get_names(self.pkgSack))
+
+        for name in matched:
+            self.install(name=name)
+
+        for pattern in matcher.unmatched(matched):
+            # Let Yum try harder (e.g with provides), or complain
             self.install(pattern=pattern)
 
         # Get new packages to be installed as dependencies
@@ -240,10 +1125,21 @@ class NBYumBase(yum.YumBase):
                       " ".join(unexpectedly_installed_sms)))
             raise NBYumException(msg)
 
-        if len(self.tsInfo.getMembers()):
+        if not len(self.tsInfo.getMembers()):
+            return
+
+        if plan:
+            return self.save_plan("install")
+
+        if download_only:
+            self.__download_transaction()
+
+        else:
             self.processTransaction(rpmDisplay=NBYumRPMCallback())
 
-    def list_packages(self, type_, status, patterns, show_hidden=False):
+    @stage("recap")
+    def list_packages(self, type_, status, patterns, show_hidden=False,
+                      fields=LIST_FIELDS, stream=False):
         """List packages and security modules."""
         if type_ == "sms":
             type_filter = self.__sms_filter
@@ -257,91 +1153,43 @@ class NBYumBase(yum.YumBase):
         else:
             hidden_filter = lambda x: True
 
-        patterns = self.__sanitize_patterns(patterns, type_)
+        patterns = sanitize_patterns(patterns, type_)
+
+        results = []
 
-        installed = []
         if status in ("all", "installed"):
             pkgs = self.__get_packages_list(patterns, type_filter,
                                             status="installed")
+            results.append(("installed", pkgs))
 
-            for pkg in sorted(pkgs, key=list_ordergetter):
-                pkgdict = {"name": pkg.name, "version": get_version(pkg),
-                           "summary": pkg.summary,
-                           "description": pkg.description}
-
-                # Filter multiarch dupes for arches others than the system one.
-                # We can just compare with the previous one because packages
-                # are ordered by nevra.
-                if len(installed) and \
-                   installed[-1].get("name", None) == pkgdict["name"] and \
-                   installed[-1].get("version", None) == pkgdict["version"]:
-                    # This is a multiarch dupe
-
-                    if previous_arch == self.arch.basearch and \
-                       pkg.arch != self.arch.basearch:
-                        continue
-
-                    elif previous_arch != self.arch.basearch and \
-                         pkg.arch == self.arch.basearch:
-                        installed.pop()
-
-                installed.append(pkgdict)
-
-                # Keep for next iteration
-                previous_arch = pkg.arch
-
-        available = []
         if status in ("all", "available"):
             pkgs = self.__get_packages_list(patterns, type_filter,
                                             hidden_filter=hidden_filter,
                                             status="available")
 
-            for pkg in sorted(pkgs, key=list_ordergetter):
-                if type_ == "sms" and self.rpmdb.installed(name=pkg.name):
-                    # For security modules, we only want to show the ones that
-                    # are **not installed**, even if in a different version
-                    continue
-
-                pkgdict = {"name": pkg.name, "version": get_version(pkg),
-                           "summary": pkg.summary,
-                           "description": pkg.description}
-
-                # Filter multiarch dupes for arches others than the system one.
-                # We can just compare with the previous one because packages
-                # are ordered by nevra.
-                if len(available) and \
-                   available[-1].get("name", None) == pkgdict["name"] and \
-                   available[-1].get("version", None) == pkgdict["version"]:
-                    # This is a multiarch dupe!
-
-                    if previous_arch == self.arch.basearch and \
-                       pkg.arch != self.arch.basearch:
-                        continue
-
-                    elif previous_arch != self.arch.basearch and \
-                         pkg.arch == self.arch.basearch:
-                        available.pop()
+            if type_ == "sms":
+                # For security modules, we only want to show the ones that
+                # are **not installed**, even if in a different version
+                installed = self.installed_set.names
+                pkgs = ifilter(lambda x: x.name not in installed, pkgs)
 
-                available.append(pkgdict)
+            results.append(("available", pkgs))
 
-                # Keep for next iteration
-                previous_arch = pkg.arch
+        recap_packages(results, fields, self.arch.basearch, stream=stream)
 
-        pkgs = {}
-        if installed:
-            pkgs["installed"] = installed
-        if available:
-            pkgs["available"] = available
+    def remove_packages(self, type_, patterns, plan=False):
+        """Remove packages and security modules."""
+        patterns = sanitize_patterns(patterns, type_)
 
-        if pkgs:
-            self.logger.log_recap(pkgs)
+        # FIXME: What if a pattern matches `nbsm-*' and type is `packages'?
+        matcher = PatternMatcher(patterns)
+        matched = matcher.filter(sorted(self.installed_set.names))
 
-    def remove_packages(self, type_, patterns):
-        """Remove packages and security modules."""
-        patterns = self.__sanitize_patterns(patterns, type_)
+        for name in matched:
+            self.remove(name=name)
 
-        for pattern in patterns:
-            # FIXME: What if a pattern matches `nbsm-*' and type is `packages'?
+        for pattern in matcher.unmatched(matched):
+            # Let Yum try harder (e.g with provides), or complain
             self.remove(pattern=pattern)
 
         # Get new packages to be installed as dependencies
@@ -360,14 +1208,18 @@ class NBYumBase(yum.YumBase):
                          '\n  - '.join(unexpectedly_removed_sms))
             raise NBYumException(msg)
 
+        if len(self.tsInfo.getMembers()) and plan:
+            return self.save_plan("remove")
+
         if len(self.tsInfo.getMembers()):
             # FIXME: We only need the installroot parameter to work around a Yum bug:
             #     https://bugzilla.redhat.com/show_bug.cgi?id=684686#c6
             # When it's fixed, just nuke it out of here
             self.processTransaction(rpmDisplay=NBYumRPMCallback(installroot=self.conf.installroot))
 
-    def update_packages(self, patterns, apply=False):
-        """Check for updates and optionally apply."""
+    def update_packages(self, patterns, apply=False, download_only=False,
+                        plan=False):
+        """Check for updates and optionally apply, or just download them."""
         if patterns:
             for pattern in patterns:
                 self.update(pattern=pattern)
@@ -383,15 +1235,30 @@ class NBYumBase(yum.YumBase):
         if not len(self.tsInfo.getMembers()):
             self.verbose_logger.info("All packages are up to date.")
 
+        elif plan:
+            return self.save_plan("update")
+
+        elif download_only:
+            self.__download_transaction()
+
         elif apply:
             self.processTransaction(rpmDisplay=NBYumRPMCallback())
 
         else:
             self.__cleanup_transaction_file()
 
-    def recap_transaction(self):
-        """Print a summary of the transaction."""
-        suggest_reboot = False
+    @stage("recap")
+    def recap_transaction(self, plan=None):
+        """Print a summary of the transaction.
+
+        If it was saved as a plan, its token is part of the summary.
+        """
+        reboot_notices = self.__transaction_reboot_notices
+        self.__transaction_reboot_notices = None
+
+        if reboot_notices is None:
+            # Nothing ran, e.g when checking for updates or planning
+            reboot_notices = self.__get_transaction_reboot_notices()
 
         pkgs = {}
 
@@ -399,15 +1266,6 @@ class NBYumBase(yum.YumBase):
                              key=transaction_ordergetter):
             pkg = {"name": member.name}
 
-            if not suggest_reboot:
-                for po in self.rpmdb.searchNevra(name=member.po.name,
-                                                 arch=member.po.arch):
-                    notices = self.updatemd.get_applicable_notices(po.pkgtup)
-
-                    for (pkgtup, notice) in notices:
-                        if notice["reboot_suggested"]:
-                            suggest_reboot = True
-
             # Packages newly installed (install_only when running an update)
             if member.ts_state == "i":
                 pkg.update({"new": get_version(member.po)})
@@ -481,8 +1339,14 @@ class NBYumBase(yum.YumBase):
                       " report it as a bug." % (member.po, member.ts_state)
                 raise WTFException(msg)
 
+        if reboot_notices:
+            pkgs["reboot_suggested"] = sorted(reboot_notices)
+
+        if plan is not None:
+            pkgs["plan"] = plan
+
         if pkgs:
             self.logger.log_recap(pkgs)
 
-        if suggest_reboot:
+        if reboot_notices:
             self.verbose_logger.info("This update requires a reboot")
@@ -76,13 +76,21 @@ class TestCase(unittest.TestCase):
                ]
         subprocess.check_call(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
 
-    def _run_nbyum_test(self, args, expected):
-        """This is not a test method, just a helper to avoid duplication."""
+    def _run_nbyum(self, args, stdin=None):
+        """Not a test, just a handy helper.
+
+        This runs nbyum and returns the JSON objects it printed.
+        """
         cmd = ["./nbyum", "-c", self.yumconf] + args
-        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
-        stdout, unused = proc.communicate()
+        proc = subprocess.Popen(cmd, stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        stdout, unused = proc.communicate(stdin)
+
+        return [json.loads(line) for line in stdout.split("\n") if line]
 
-        result = [json.loads(line) for line in stdout.split("\n") if line]
+    def _run_nbyum_test(self, args, expected, stdin=None):
+        """This is not a test method, just a helper to avoid duplication."""
+        result = self._run_nbyum(args, stdin=stdin)
 
         self.assertEqual(result, expected,
                          msg="\n".join(self._gen_diff(result, expected)))
@@ -133,10 +141,19 @@ class TestCase(unittest.TestCase):
 
 
 # Make sure the unit tests are discovered
+from test_batch import *
+from test_catalog import *
 from test_checkupdate import *
+from test_commit import *
 from test_info import *
 from test_install_sms import *
 from test_list import *
 from test_list_sms import *
+from test_lock import *
+from test_patterns import *
+from test_refresh import *
 from test_remove_sms import *
+from test_serve import *
+from test_stats import *
+from test_startup import *
 from test_update import *
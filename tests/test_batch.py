@@ -0,0 +1,33 @@
+from tests import TestCase
+
+
+class TestBatch(TestCase):
+    command = "batch"
+
+    def test_batch(self):
+        """Run a few commands against a single Yum base."""
+        args = [self.command]
+        stdin = "\n".join(["info foo",
+                           "",
+                           "info 'no such package'",
+                           "list --no-such-option",
+                           "info bar*",
+                           ])
+
+        # -- Check the output of each command ----------------------
+        expected = [{"type": "progress", "id": 1, "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "id": 1, "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "id": 1, "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "id": 1, "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap", "id": 1, "pkginfos": [{"name": "foo", "license": "MIT", "base_package_name": "foo",
+                                                             "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Foo",
+                                                             "description": "This package provides you the joy of getting some Foo."}]},
+                    {"type": "exit", "id": 1, "code": 0},
+                    {"type": "exit", "id": 3, "code": 0},
+                    {"type": "log", "id": 4, "error": "too few arguments"},
+                    {"type": "exit", "id": 4, "code": 2},
+                    {"type": "recap", "id": 5, "pkginfos": [{"name": "bar", "license": "MIT", "base_package_name": "bar",
+                                                             "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Bar",
+                                                             "description": "This package provides you the joy of getting some Bar."}]},
+                    {"type": "exit", "id": 5, "code": 0}]
+        self._run_nbyum_test(args, expected, stdin=stdin)
@@ -0,0 +1,210 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from nbyum.catalog import (InstalledSet, best_packages, open_catalog,
+                           write_catalog)
+
+
+class FakePackage(object):
+    """Quacks enough like a Yum package object to be written in a catalog."""
+    def __init__(self, name, version, release, arch, epoch="0",
+                 description=None):
+        self.name = name
+        self.epoch = epoch
+        self.version = version
+        self.release = release
+        self.arch = arch
+        self.group = "System Environment/Base"
+        self.summary = "Get some %s" % name
+        self.description = description or "Blabla about %s" % name
+
+    @property
+    def pkgtup(self):
+        return (self.name, self.arch, self.epoch, self.version, self.release)
+
+
+PACKAGES = [FakePackage("toto", "2", "1.nb5.0", "noarch"),
+            FakePackage("foo", "1", "2.nb5.0", "x86_64"),
+            FakePackage("foo", "1", "1.nb5.0", "x86_64"),
+            FakePackage("bar", "1", "1.nb5.0", "noarch", epoch="1"),
+            FakePackage("nbsm-foo", "1", "1.nb5.0", "noarch",
+                        description=u"Un module \xe0 foo")]
+
+
+class TestCatalog(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmpdir, "nbyum", "test.catalog")
+        self.key = {"repos": {"test": "0123456789abcdef"}}
+
+        write_catalog(self.path, self.key, PACKAGES)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_open(self):
+        """Open a catalog only for the key it was written for."""
+        catalog = open_catalog(self.path, self.key)
+        self.assertEqual(len(catalog), len(PACKAGES))
+        self.assertEqual(catalog.key, self.key)
+        catalog.close()
+
+        catalog = open_catalog(self.path, None)
+        self.assertEqual(len(catalog), len(PACKAGES))
+        catalog.close()
+
+        self.assertEqual(open_catalog(self.path, {"repos": {}}), None)
+        self.assertEqual(open_catalog("%s.nosuchfile" % self.path, None),
+                         None)
+
+    def test_not_a_catalog(self):
+        """Refuse files which are not catalogs."""
+        with open(self.path, "w") as f:
+            f.write("This is not a catalog, not even a header")
+
+        self.assertEqual(open_catalog(self.path, None), None)
+
+    def test_packages(self):
+        """Read the packages back, sorted by name."""
+        catalog = open_catalog(self.path, self.key)
+
+        try:
+            self.assertEqual(catalog.names(),
+                             ["bar", "foo", "nbsm-foo", "toto"])
+            self.assertEqual(sorted(catalog.simplePkgList()),
+                             sorted([pkg.pkgtup for pkg in PACKAGES]))
+
+            bar = catalog[0]
+            self.assertEqual(bar.pkgtup,
+                             ("bar", "noarch", "1", "1", "1.nb5.0"))
+            self.assertEqual(str(bar), "1:bar-1-1.nb5.0.noarch")
+            self.assertEqual(bar.summary, "Get some bar")
+            self.assertEqual(bar.group, "System Environment/Base")
+            self.assertEqual(bar.description, "Blabla about bar")
+
+            self.assertRaises(IndexError, catalog.__getitem__,
+                              len(PACKAGES))
+
+        finally:
+            catalog.close()
+
+    def test_search_names(self):
+        """Find all the packages with some names, by bisecting."""
+        catalog = open_catalog(self.path, self.key)
+
+        try:
+            result = catalog.searchNames(["nosuchname", "nbsm-foo", "foo",
+                                          "foo"])
+            self.assertEqual([str(pkg) for pkg in result],
+                             ["foo-1-1.nb5.0.x86_64", "foo-1-2.nb5.0.x86_64",
+                              "nbsm-foo-1-1.nb5.0.noarch"])
+
+            # Descriptions are stored as UTF-8
+            self.assertEqual(result[-1].description,
+                             u"Un module \xe0 foo".encode("utf-8"))
+
+            self.assertEqual(catalog.searchNames(["a", "zzz"]), [])
+
+        finally:
+            catalog.close()
+
+    def test_empty(self):
+        """Write and read a catalog without any package."""
+        write_catalog(self.path, self.key, [])
+        catalog = open_catalog(self.path, self.key)
+
+        try:
+            self.assertEqual(len(catalog), 0)
+            self.assertEqual(catalog.names(), [])
+            self.assertEqual(catalog.searchNames(["foo"]), [])
+
+        finally:
+            catalog.close()
+
+
+class TestBestPackages(unittest.TestCase):
+    def _check_best(self, pkgs, expected, archlist=None):
+        """Not a test, just a handy helper."""
+        result = best_packages(pkgs, archlist)
+
+        self.assertEqual(sorted([pkg.pkgtup for pkg in result]),
+                         sorted([pkg.pkgtup for pkg in expected]))
+
+    def test_newest(self):
+        """Choose the newest version, comparing epochs first."""
+        old = FakePackage("foo", "1", "10", "noarch")
+        new = FakePackage("foo", "1", "9", "noarch", epoch="1")
+
+        self._check_best([old, new], [new])
+
+    def test_multilib(self):
+        """Choose the newest of both multilib and singlelib arches."""
+        multi_old = FakePackage("foo", "1", "1", "x86_64")
+        multi_new = FakePackage("foo", "1", "2", "x86_64")
+        single = FakePackage("foo", "1", "1", "i686")
+
+        self._check_best([multi_old, single, multi_new], [multi_new, single])
+
+    def test_noarch(self):
+        """Choose a noarch package only if it is the newest."""
+        archful = FakePackage("foo", "1", "2", "x86_64")
+        noarch_old = FakePackage("foo", "1", "1", "noarch")
+        noarch_new = FakePackage("foo", "1", "3", "noarch")
+
+        self._check_best([archful, noarch_old], [archful])
+        self._check_best([archful, noarch_new], [noarch_new])
+
+    def test_archlist(self):
+        """Ignore the packages for other arches."""
+        ppc = FakePackage("foo", "1", "2", "ppc64")
+        noarch = FakePackage("foo", "1", "1", "noarch")
+
+        self._check_best([ppc, noarch], [noarch],
+                         archlist=["x86_64", "i686", "noarch"])
+        self._check_best([ppc], [], archlist=["x86_64", "i686", "noarch"])
+
+
+class TestInstalledSet(unittest.TestCase):
+    def setUp(self):
+        self.installed = InstalledSet([pkg.pkgtup for pkg in PACKAGES])
+
+    def test_membership(self):
+        """Tell which packages and names are installed."""
+        self.assertTrue(("foo", "x86_64", "0", "1", "2.nb5.0")
+                        in self.installed.pkgtups)
+        self.assertFalse(("foo", "i686", "0", "1", "2.nb5.0")
+                         in self.installed.pkgtups)
+        self.assertEqual(self.installed.names,
+                         set(["bar", "foo", "nbsm-foo", "toto"]))
+
+    def test_search(self):
+        """Find the installed versions of a name.arch."""
+        self.assertEqual(sorted(self.installed.search("foo", "x86_64")),
+                         [("foo", "x86_64", "0", "1", "1.nb5.0"),
+                          ("foo", "x86_64", "0", "1", "2.nb5.0")])
+        self.assertEqual(self.installed.search("foo", "i686"), [])
+        self.assertEqual(self.installed.search("nosuchname", "noarch"), [])
+
+    def test_from_catalog(self):
+        """Build the set from a catalog, as from an installed snapshot."""
+        tmpdir = tempfile.mkdtemp()
+
+        try:
+            path = os.path.join(tmpdir, "installed.catalog")
+            write_catalog(path, None, PACKAGES)
+
+            catalog = open_catalog(path, None)
+            try:
+                installed = InstalledSet(catalog.simplePkgList())
+
+            finally:
+                catalog.close()
+
+        finally:
+            shutil.rmtree(tmpdir)
+
+        self.assertEqual(installed.pkgtups, self.installed.pkgtups)
+        self.assertEqual(installed.search("bar", "noarch"),
+                         [("bar", "noarch", "1", "1", "1.nb5.0")])
@@ -11,6 +11,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "log", "info": "All packages are up to date."}]
         self._run_nbyum_test(args, expected)
@@ -21,6 +23,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
@@ -32,6 +36,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "install": [{"name": "bar", "new": "1-2.nb5.0"}]}]
@@ -43,6 +49,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "install": [{"new": "2-1.nb5.0", "name": "baz"}],
@@ -55,6 +63,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "install": [{"name": "plouf", "new": "2-1.nb5.0"}],
@@ -67,6 +77,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "install": [{"name": "baz", "new": "2-1.nb5.0"},
@@ -82,6 +94,8 @@ class TestCheckUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "install": [{"name": "bar", "new": "1-2.nb5.0"},
@@ -89,3 +103,37 @@ class TestCheckUpdate(TestCase):
                      "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"},
                                 {"name": "toto", "old": "1-1.nb5.0", "new": "2-1.nb5.0"}]}]
         self._run_nbyum_test(args, expected)
+
+    def test_reboot_suggested(self):
+        """Check a repo with an update suggesting a reboot."""
+        args = [self.command]
+
+        # -- Check the update summary ------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}],
+                     "reboot_suggested": ["NBSA-2014:0042"]},
+                    {"type": "log", "info": "This update requires a reboot"}]
+        self._run_nbyum_test(args, expected)
+
+    def test_cached(self):
+        """Check twice, the second time from the cached result."""
+        args = [self.command]
+
+        # -- Check the update summary ------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
+        self._run_nbyum_test(args, expected)
+
+        # -- Check the same summary, without the processing --------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
+        self._run_nbyum_test(args, expected)
@@ -0,0 +1,69 @@
+from tests import TestCase
+
+
+class TestCommit(TestCase):
+    command = "commit"
+    installonlypkgs = "bar"
+
+    def test_commit_no_such_plan(self):
+        """Make sure we complain about unknown plans."""
+        args = [self.command, "0123456789abcdef0123456789abcdef"]
+
+        # -- Check the error message -------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "log", "error": "No such plan: 0123456789abcdef0123456789abcdef"}]
+        self._run_nbyum_test(args, expected)
+
+    def test_commit_plan(self):
+        """Apply an update planned beforehand."""
+        # -- Plan the update first ---------------------------------
+        result = self._run_nbyum(["update", "--plan"])
+        recap = result[-1]
+        token = recap.pop("plan")
+
+        expected = {"type": "recap",
+                    "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}
+        self.assertEqual(recap, expected)
+
+        # -- Check the installed packages after the plan -----------
+        expected = ["0:bar-1-1.nb5.0.noarch",
+                    "0:foo-1-1.nb5.0.noarch",
+                    "0:nbsm-foo-1-1.nb5.0.noarch",
+                    "0:toto-1-1.nb5.0.noarch"]
+        self._check_installed_rpms(expected)
+
+        # -- Check the update summary ------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Installed: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Removed: foo"},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Verified: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Verified: foo-1-1.nb5.0.noarch"},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
+        self._run_nbyum_test([self.command, token], expected)
+
+        # -- Check the installed packages after the commit ---------
+        expected = ["0:bar-1-1.nb5.0.noarch",
+                    "0:foo-1-2.nb5.0.noarch",
+                    "0:nbsm-foo-1-1.nb5.0.noarch",
+                    "0:toto-1-1.nb5.0.noarch"]
+        self._check_installed_rpms(expected)
+
+    def test_commit_plan_cleaned(self):
+        """Make sure rebuilding the cache throws the plans away."""
+        # -- Plan the update first ---------------------------------
+        result = self._run_nbyum(["update", "--plan"])
+        token = result[-1]["plan"]
+
+        self._run_nbyum(["rebuild-cache"])
+
+        # -- Check the error message -------------------------------
+        result = self._run_nbyum([self.command, token])
+        self.assertEqual(result[-1], {"type": "log",
+                                      "error": "No such plan: %s" % token})
@@ -10,6 +10,8 @@ class TestInfo(TestCase):
 
         # -- Check the infos ---------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."}]
         self._run_nbyum_test(args, expected)
 
@@ -19,6 +21,8 @@ class TestInfo(TestCase):
 
         # -- Check the infos ---------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap", "pkginfos": [{"name": "foo", "license": "MIT", "base_package_name": "foo",
                                                     "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Foo",
@@ -31,6 +35,8 @@ class TestInfo(TestCase):
 
         # -- Check the infos ---------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap", "pkginfos": [{"name": "bar", "license": "MIT", "base_package_name": "bar",
                                                     "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Bar",
@@ -49,6 +55,8 @@ class TestInfo(TestCase):
 
         # -- Check the infos ---------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap", "pkginfos": [{"name": "bdummy", "license": "MIT", "base_package_name": "bdummy",
                                                     "version": "1-1.nb5.0", "arch": "noarch", "summary": "Not just any dummy",
@@ -56,3 +64,38 @@ class TestInfo(TestCase):
                                                                    "main \"feature\" is to make it's alright to have " \
                                                                    "apostrophes in a field, so\nlet's add one more :'}\""}]}]
         self._run_nbyum_test(args, expected)
+
+    def test_info_stream(self):
+        """Print the infos for a list of packages, one line at a time."""
+        args = [self.command, "--stream", "*foo*", "bar*"]
+
+        # -- Check the infos ---------------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap-item", "pkginfos": {"name": "bar", "license": "MIT", "base_package_name": "bar",
+                                                        "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Bar",
+                                                        "description": "This package provides you the joy of getting some Bar."}},
+                    {"type": "recap-item", "pkginfos": {"name": "foo", "license": "MIT", "base_package_name": "foo",
+                                                        "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Foo",
+                                                        "description": "This package provides you the joy of getting some Foo."}},
+                    {"type": "recap-item", "pkginfos": {"name": "nbsm-foo", "license": "MIT", "base_package_name": "nbsm-foo",
+                                                        "version": "1-1.nb5.0", "arch": "noarch", "summary": "Security Module to get some Foo",
+                                                        "description": "This package provides you the joy of getting some Foo."}},
+                    {"type": "recap-end", "pkginfos": 3}]
+        self._run_nbyum_test(args, expected)
+
+    def test_info_fields(self):
+        """Print only some infos for a list of packages."""
+        args = [self.command, "--fields", "name,version", "*foo*", "bar*"]
+
+        # -- Check the infos ---------------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap", "pkginfos": [{"name": "bar", "version": "1-1.nb5.0"},
+                                                   {"name": "foo", "version": "1-1.nb5.0"},
+                                                   {"name": "nbsm-foo", "version": "1-1.nb5.0"}]}]
+        self._run_nbyum_test(args, expected)
@@ -12,6 +12,8 @@ class TestInstallSms(TestCase):
 
         # -- Check the error message -------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "log", "error": "No package(s) available to install"}]
         self._run_nbyum_test(args, expected)
@@ -29,6 +31,8 @@ class TestInstallSms(TestCase):
 
         # -- Check the warning message -----------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "log", "warning": "Package nbsm-foo-1-1.nb5.0.noarch already installed and latest version"}]
         self._run_nbyum_test(args, expected)
@@ -46,6 +50,8 @@ class TestInstallSms(TestCase):
 
         # Check the installation summary ---------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 1, "hint": "Installed: nbsm-bar-1-1.nb5.0.noarch"},
                     {"type": "progress", "current": 1, "total": 1, "hint": "Verified: nbsm-bar-1-1.nb5.0.noarch"},
@@ -67,6 +73,8 @@ class TestInstallSms(TestCase):
 
         # Check the installation summary ---------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 2, "hint": "Installed: plouf-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 2, "hint": "Installed: nbsm-plouf-1-1.nb5.0.noarch"},
@@ -92,6 +100,8 @@ class TestInstallSms(TestCase):
 
         # Check the installation summary ---------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 3, "hint": "Installed: plouf-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 3, "hint": "Installed: nbsm-plouf-1-1.nb5.0.noarch"},
@@ -121,6 +131,10 @@ class TestInstallSms(TestCase):
         # -- Check the installation summary -----------------------------
         expected = [{"type": "progress", "current": 0, "total": 1,
                      "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2,
+                     "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2,
+                     "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1,
                      "hint": "Processing the package metadata..."},
                     {"type": "log",
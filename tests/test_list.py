@@ -11,13 +11,23 @@ class TestListPackages(TestCase):
         args = [self.command, "installed", "packages"]
 
         # -- Check the listing -------------------------------------
-        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
-                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
-                    {"type": "recap",
+        expected = [{"type": "recap",
+                     "installed": [{"name": "bar", "version": "1-1.nb5.0", "summary": "Get some Bar"},
+                                   {"name": "foo", "version": "1-1.nb5.0", "summary": "Get some Foo"},
+                                   {"name": "toto", "version": "1-1.nb5.0", "summary": "Get some Toto"}]}]
+        self._run_nbyum_test(args, expected)
+
+    def test_list_installed_packages_snapshot(self):
+        """List installed packages twice, the second time from the snapshot."""
+        args = [self.command, "installed", "packages"]
+
+        # -- Check the listing -------------------------------------
+        expected = [{"type": "recap",
                      "installed": [{"name": "bar", "version": "1-1.nb5.0", "summary": "Get some Bar"},
                                    {"name": "foo", "version": "1-1.nb5.0", "summary": "Get some Foo"},
                                    {"name": "toto", "version": "1-1.nb5.0", "summary": "Get some Toto"}]}]
         self._run_nbyum_test(args, expected)
+        self._run_nbyum_test(args, expected)
 
     def test_list_available_packages(self):
         """List available packages."""
@@ -25,6 +35,8 @@ class TestListPackages(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "available": [{"name": "baz", "version": "2-1.nb5.0", "summary": "Get some Baz"},
@@ -39,6 +51,8 @@ class TestListPackages(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "installed": [{"name": "bar", "version": "1-1.nb5.0", "summary": "Get some Bar"},
@@ -56,6 +70,8 @@ class TestListPackages(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."}]
         self._run_nbyum_test(args, expected)
 
@@ -65,6 +81,8 @@ class TestListPackages(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "installed": [{"name": "foo", "version": "1-1.nb5.0", "summary": "Get some Foo"}],
@@ -82,6 +100,9 @@ class TestListPackages(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 3, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 3, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 3, "total": 3, "hint": "Fetched the metadata of test2"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "available": [{"name": "foo", "version": "1-3.nb5.0", "summary": "Get some Foo"}]}]
@@ -9,9 +9,7 @@ class TestListSMs(TestCase):
         args = [self.command, "installed", "sms"]
 
         # -- Check the listing -------------------------------------
-        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
-                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
-                    {"type": "recap",
+        expected = [{"type": "recap",
                      "installed": [{"name": "nbsm-foo", "version": "1-1.nb5.0", "summary": "Security Module to get some Foo"}]}]
         self._run_nbyum_test(args, expected)
 
@@ -21,6 +19,8 @@ class TestListSMs(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "available": [{"name": "nbsm-bar", "version": "1-1.nb5.0", "summary": "Security Module to meet Toto"}]}]
@@ -32,6 +32,8 @@ class TestListSMs(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "installed": [{"name": "nbsm-foo", "version": "1-1.nb5.0", "summary": "Security Module to get some Foo"}],
@@ -44,6 +46,8 @@ class TestListSMs(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."}]
         self._run_nbyum_test(args, expected)
 
@@ -53,6 +57,8 @@ class TestListSMs(TestCase):
 
         # -- Check the listing -------------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "recap",
                      "installed": [{"name": "nbsm-foo", "version": "1-1.nb5.0", "summary": "Security Module to get some Foo"}],
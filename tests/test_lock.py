@@ -0,0 +1,141 @@
+import json
+import subprocess
+
+from tests import TestCase
+
+
+# Hold the Yum lock for a while, as another administrator would
+HOLD_LOCK = """
+import sys
+import time
+
+import yum
+
+base = yum.YumBase()
+base.preconf.fn = sys.argv[1]
+base.preconf.debuglevel = 0
+base.doLock()
+
+sys.stdout.write("locked\\n")
+sys.stdout.flush()
+
+time.sleep(float(sys.argv[2]))
+base.doUnlock()
+"""
+
+
+class TestLock(TestCase):
+    command = "lock"
+
+    def _hold_lock(self, seconds):
+        """Not a test, just a handy helper."""
+        proc = subprocess.Popen(["python", "-c", HOLD_LOCK, self.yumconf,
+                                 str(seconds)], stdout=subprocess.PIPE)
+
+        # Wait until it actually holds the lock
+        self.assertEqual(proc.stdout.readline(), "locked\n")
+
+        return proc
+
+    def test_locked(self):
+        """Fail immediately when the lock is held."""
+        holder = self._hold_lock(5)
+
+        try:
+            result = self._run_nbyum(["list", "available", "sms"])
+
+        finally:
+            holder.wait()
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]["type"], "log")
+        self.assertTrue(result[0]["error"].startswith(
+                "The package system is being used by another administrator"))
+        self.assertTrue("pid: %s" % holder.pid in result[0]["error"])
+
+    def test_wait_lock(self):
+        """Wait for the lock to be released."""
+        holder = self._hold_lock(2)
+
+        try:
+            result = self._run_nbyum(["--wait-lock", "30",
+                                      "list", "available", "sms"])
+
+        finally:
+            holder.wait()
+
+        # -- Check we told who we were waiting for -----------------
+        waiting = result.pop(0)
+        self.assertEqual(waiting["type"], "progress")
+        self.assertTrue(waiting["hint"].startswith("Waiting for the lock "
+                                                   "held by root"))
+        self.assertTrue("pid: %s" % holder.pid in waiting["hint"])
+
+        # -- Then we got the lock, and did what we were asked ------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap",
+                     "available": [{"name": "nbsm-bar", "version": "1-1.nb5.0", "summary": "Security Module to meet Toto"}]}]
+        self.assertEqual(result, expected)
+
+    def test_wait_lock_queued(self):
+        """Tell who holds the lock, even when not first in the queue."""
+        holder = self._hold_lock(3)
+
+        try:
+            cmd = ["./nbyum", "-c", self.yumconf, "--wait-lock", "30",
+                   "list", "available", "sms"]
+            first = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                     stderr=subprocess.STDOUT)
+
+            try:
+                # Make sure the first waiter is in the queue before us
+                self.assertEqual(json.loads(first.stdout.readline())["type"],
+                                 "progress")
+
+                result = self._run_nbyum(["--wait-lock", "30",
+                                          "list", "available", "sms"])
+
+            finally:
+                first.communicate()
+
+        finally:
+            holder.wait()
+
+        waiting = result[0]
+        self.assertEqual(waiting["type"], "progress")
+        self.assertTrue(waiting["hint"].startswith("Waiting for the lock "
+                                                   "held by root"))
+        self.assertTrue("pid: %s" % holder.pid in waiting["hint"])
+
+    def test_list_while_locked(self):
+        """List packages from the published snapshot while Yum is busy."""
+        args = ["list", "all", "packages"]
+
+        recap = {"type": "recap",
+                 "installed": [{"name": "bar", "version": "1-1.nb5.0", "summary": "Get some Bar"},
+                               {"name": "foo", "version": "1-1.nb5.0", "summary": "Get some Foo"},
+                               {"name": "toto", "version": "1-1.nb5.0", "summary": "Get some Toto"}],
+                 "available": [{"name": "baz", "version": "2-1.nb5.0", "summary": "Get some Baz"},
+                               {"name": "foo", "version": "1-2.nb5.0", "summary": "Get some Foo"},
+                               {"name": "plouf", "version": "2-1.nb5.0", "summary": "Get some Plouf"},
+                               {"name": "toto", "version": "2-1.nb5.0", "summary": "Get some Toto"}]}
+
+        # -- The first listing publishes the snapshot --------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    recap]
+        self._run_nbyum_test(args, expected)
+
+        # -- The second one doesn't wait for the lock --------------
+        holder = self._hold_lock(5)
+
+        try:
+            self._run_nbyum_test(args, [recap])
+
+        finally:
+            holder.wait()
@@ -0,0 +1,57 @@
+from fnmatch import fnmatchcase
+import unittest
+
+from nbyum.patterns import PatternMatcher
+
+
+NAMES = sorted(["bar", "baz", "foo", "foo-devel", "foobar", "nbsm-bar",
+                "nbsm-base", "nbsm-foo", "plouf", "toto", "toto[1]"])
+
+
+class TestPatterns(unittest.TestCase):
+    def _check_filter(self, patterns):
+        """Not a test, just a handy helper.
+
+        This checks the matcher agrees with fnmatch, one name at a time.
+        """
+        matcher = PatternMatcher(patterns)
+        expected = [name for name in NAMES
+                    if [p for p in patterns if fnmatchcase(name, p)]]
+
+        self.assertEqual(matcher.filter(NAMES), expected)
+        self.assertEqual([name for name in NAMES if matcher.match(name)],
+                         expected)
+
+    def test_literals(self):
+        """Match names exactly."""
+        self._check_filter(["foo", "toto", "nosuchname"])
+
+    def test_globs(self):
+        """Match names with all kinds of globs."""
+        self._check_filter(["fo*", "ba?", "nbsm-[bf]*", "[!n]*ou*"])
+
+    def test_no_prefix(self):
+        """Match globs without any literal prefix against all names."""
+        self._check_filter(["*bar", "?oo"])
+
+    def test_nested_prefixes(self):
+        """Match globs whose prefixes are prefixes of each other."""
+        self._check_filter(["nbsm-*", "nbsm-ba*", "nbsm-f?o", "n*"])
+
+    def test_special_characters(self):
+        """Match names with characters special to regular expressions."""
+        self._check_filter(["toto[[]1]", "foo-d*", "[", "toto[1"])
+
+    def test_unmatched(self):
+        """Get the patterns which match nothing."""
+        matcher = PatternMatcher(["foo", "nosuchname", "nbsm-*", "nbsm-x*",
+                                  "*bar", "z*", "b?"])
+
+        self.assertEqual(matcher.unmatched(NAMES),
+                         ["nosuchname", "nbsm-x*", "z*", "b?"])
+
+    def test_unmatched_all(self):
+        """Get all the patterns when there are no names at all."""
+        matcher = PatternMatcher(["foo", "*"])
+
+        self.assertEqual(matcher.unmatched([]), ["foo", "*"])
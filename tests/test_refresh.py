@@ -0,0 +1,35 @@
+from tests import TestCase
+
+
+class TestRefresh(TestCase):
+    command = "refresh"
+
+    def test_refresh(self):
+        """Refresh the metadata, then list without downloading it."""
+        args = [self.command]
+
+        # -- Check the refresh -------------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."}]
+        self._run_nbyum_test(args, expected)
+
+        # -- Check the listing doesn't download anything -----------
+        args = ["list", "available", "packages"]
+
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "recap",
+                     "available": [{"name": "baz", "version": "2-1.nb5.0", "summary": "Get some Baz"},
+                                   {"name": "foo", "version": "1-2.nb5.0", "summary": "Get some Foo"},
+                                   {"name": "plouf", "version": "2-1.nb5.0", "summary": "Get some Plouf"},
+                                   {"name": "toto", "version": "2-1.nb5.0", "summary": "Get some Toto"}]}]
+        self._run_nbyum_test(args, expected)
+
+        # -- Unless the refresh is too old -------------------------
+        args = ["--max-cache-age", "0", "list", "available", "packages"]
+
+        # The catalog is still up to date, so only the repositories are
+        # checked for changes
+        expected.insert(0, {"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."})
+        self._run_nbyum_test(args, expected)
@@ -12,6 +12,8 @@ class TestRemoveSms(TestCase):
 
         # -- Check the error message -------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "log", "error": "No Match for argument: nbsm-no_such_security_module"}]
         self._run_nbyum_test(args, expected)
@@ -29,6 +31,8 @@ class TestRemoveSms(TestCase):
 
         # -- Check the removal summary -----------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 1, "hint": "Removed: nbsm-foo"},
                     {"type": "progress", "current": 1, "total": 1, "hint": "Verified: nbsm-foo-1-1.nb5.0.noarch"},
@@ -53,6 +57,8 @@ class TestRemoveSms(TestCase):
 
         # -- Check the removal summary -----------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 2, "hint": "Removed: nbsm-bidule"},
                     {"type": "progress", "current": 2, "total": 2, "hint": "Removed: bidule"},
@@ -81,6 +87,8 @@ class TestRemoveSms(TestCase):
 
         # -- Check the removal summary -----------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "log", "error": "Proceeding would remove the following security modules:\n  - nbsm-machin\n  - nbsm-trucmuche\nTransaction aborted."}]
         self._run_nbyum_test(args, expected)
@@ -0,0 +1,73 @@
+import json
+import os
+import socket
+import subprocess
+import time
+
+from tests import TestCase
+
+
+class TestServe(TestCase):
+    command = "serve"
+
+    def _send_request(self, sockpath, request):
+        """Not a test, just a handy helper."""
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(sockpath)
+
+        try:
+            sock.sendall("%s\n" % json.dumps(request))
+
+            output = ""
+            while True:
+                data = sock.recv(4096)
+                if not data:
+                    break
+                output += data
+
+        finally:
+            sock.close()
+
+        return [json.loads(line) for line in output.split("\n") if line]
+
+    def test_serve_requests(self):
+        """Serve a few requests from a single process."""
+        sockpath = os.path.join(self.dataroot,
+                                "%s.sock" % self._testMethodName)
+
+        cmd = ["./nbyum", "-c", self.yumconf, self.command,
+               "--socket", sockpath]
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+
+        try:
+            # -- Wait for the server to be ready -------------------
+            for i in range(300):
+                if os.path.exists(sockpath):
+                    break
+                time.sleep(0.1)
+
+            # -- Check the infos -----------------------------------
+            expected = [{"type": "recap", "id": 1,
+                         "pkginfos": [{"name": "foo", "license": "MIT", "base_package_name": "foo",
+                                       "version": "1-1.nb5.0", "arch": "noarch", "summary": "Get some Foo",
+                                       "description": "This package provides you the joy of getting some Foo."}]},
+                        {"type": "exit", "id": 1, "code": 0}]
+            result = self._send_request(sockpath,
+                                        {"id": 1, "args": ["info", "foo"]})
+            self.assertEqual(result, expected,
+                             msg="\n".join(self._gen_diff(result, expected)))
+
+            # -- Check a bad request -------------------------------
+            expected = [{"type": "log", "id": 2, "error": "Invalid request: 'args'"},
+                        {"type": "exit", "id": 2, "code": 2}]
+            result = self._send_request(sockpath, {"id": 2})
+            self.assertEqual(result, expected,
+                             msg="\n".join(self._gen_diff(result, expected)))
+
+        finally:
+            proc.terminate()
+            proc.wait()
+
+            if os.path.exists(sockpath):
+                os.unlink(sockpath)
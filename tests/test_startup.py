@@ -0,0 +1,109 @@
+import json
+import os
+import subprocess
+
+from tests import TestCase
+
+
+# Run nbyum, recording how long each module took to import. When it exits,
+# the modules it loaded are written to the file passed as first argument.
+IMPORT_REPORT = """
+import __builtin__
+import atexit
+import json
+import sys
+import time
+
+report_path = sys.argv.pop(1)
+del sys.argv[0]
+timings = {}
+real_import = __builtin__.__import__
+
+def timed_import(name, *args, **kwargs):
+    before = len(sys.modules)
+    start = time.time()
+
+    try:
+        return real_import(name, *args, **kwargs)
+
+    finally:
+        if len(sys.modules) != before:
+            timings.setdefault(name, time.time() - start)
+
+def write_report():
+    with open(report_path, "w") as f:
+        json.dump({"modules": sorted(sys.modules), "timings": timings}, f)
+
+__builtin__.__import__ = timed_import
+atexit.register(write_report)
+
+execfile(sys.argv[0], {"__name__": "__main__"})
+"""
+
+# The modules which are too expensive to load for quick commands
+HEAVY_MODULES = ("yum", "yum.update_md", "urlgrabber")
+
+# Printing the help doesn't even need rpm
+HELP_HEAVY_MODULES = HEAVY_MODULES + ("rpm", )
+
+
+class TestStartup(TestCase):
+    command = "startup"
+
+    def _run_nbyum_report(self, args):
+        """Not a test, just a handy helper.
+
+        This runs nbyum and returns what it printed, along with its import
+        report.
+        """
+        report_path = os.path.join(self.dataroot,
+                                   "%s.imports" % self._testMethodName)
+
+        cmd = ["python", "-c", IMPORT_REPORT, report_path, "./nbyum",
+               "-c", self.yumconf] + args
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE,
+                                stderr=subprocess.STDOUT)
+        stdout, unused = proc.communicate()
+
+        try:
+            with open(report_path) as f:
+                report = json.load(f)
+
+        finally:
+            os.unlink(report_path)
+
+        return stdout, report
+
+    def _check_imports(self, report, heavy_modules=HEAVY_MODULES):
+        """Not a test, just a handy helper."""
+        slowest = sorted(report["timings"].items(), key=lambda x: x[1],
+                         reverse=True)[:10]
+        msg = "Slowest imports:\n%s" % "\n".join(["  %.3fs  %s" % (t, name)
+                                                  for name, t in slowest])
+
+        for module in heavy_modules:
+            self.assertFalse(module in report["modules"],
+                             msg="Imported %s\n%s" % (module, msg))
+
+    def test_help(self):
+        """Print the help without loading Yum."""
+        stdout, report = self._run_nbyum_report(["--help"])
+
+        self.assertTrue(stdout.startswith("usage: "))
+        self._check_imports(report, HELP_HEAVY_MODULES)
+
+    def test_list_installed_sms(self):
+        """List installed sms without loading Yum, from the snapshot."""
+        args = ["list", "installed", "sms"]
+
+        # -- The first run takes the snapshot ----------------------
+        expected = [{"type": "recap",
+                     "installed": [{"name": "nbsm-foo", "version": "1-1.nb5.0", "summary": "Security Module to get some Foo"}]}]
+        self._run_nbyum_test(args, expected)
+
+        # -- The second one doesn't need Yum -----------------------
+        stdout, report = self._run_nbyum_report(args)
+
+        result = [json.loads(line) for line in stdout.split("\n") if line]
+        self.assertEqual(result, expected)
+        self._check_imports(report)
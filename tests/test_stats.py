@@ -0,0 +1,33 @@
+from tests import TestCase
+
+
+class TestStats(TestCase):
+    command = "stats"
+
+    def test_stats(self):
+        """Get statistics about the previous invocations."""
+        # -- Run a few commands ------------------------------------
+        self._run_nbyum(["list", "installed", "packages"])
+        self._run_nbyum(["list", "installed", "packages"])
+        self._run_nbyum(["install", "sms", "nosuchsm"])
+
+        # -- Check the statistics ----------------------------------
+        result = self._run_nbyum([self.command])
+
+        self.assertEqual(len(result), 1)
+        self.assertEqual(result[0]["type"], "recap")
+
+        stats = result[0]["stats"]
+        self.assertEqual(sorted(stats), ["install", "list"])
+
+        self.assertEqual(stats["list"]["count"], 2)
+        self.assertEqual(stats["list"]["failures"], 0)
+        self.assertEqual(stats["install"]["count"], 1)
+        self.assertEqual(stats["install"]["failures"], 1)
+
+        for command in stats.values():
+            self.assertEqual(sorted(command["duration"]),
+                             ["max", "p50", "p90", "p99"])
+
+        # The install waited on the lock, even if just a little
+        self.assertTrue("lock_wait" in stats["install"])
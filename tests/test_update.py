@@ -1,3 +1,4 @@
+import json
 import os
 
 from tests import TestCase
@@ -13,6 +14,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "log", "info": "All packages are up to date."}]
         self._run_nbyum_test(args, expected)
@@ -30,6 +33,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 2, "hint": "Installed: foo-1-2.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 2, "hint": "Removed: foo"},
@@ -52,6 +57,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 1, "hint": "Installed: bar-1-2.nb5.0.noarch"},
                     {"type": "progress", "current": 1, "total": 1, "hint": "Verified: bar-1-2.nb5.0.noarch"},
@@ -73,6 +80,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 2, "hint": "Installed: baz-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 2, "hint": "Removed: bar"},
@@ -96,6 +105,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 3, "hint": "Installed: plouf-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 3, "hint": "Installed: toto-2-1.nb5.0.noarch"},
@@ -122,6 +133,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 7, "hint": "Installed: plouf-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 7, "hint": "Installed: toto-2-1.nb5.0.noarch"},
@@ -159,6 +172,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 6, "hint": "Installed: plouf-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 6, "hint": "Installed: toto-2-1.nb5.0.noarch"},
@@ -200,6 +215,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 2, "hint": "Installed: nbsm-foo-2-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 2, "hint": "Removed: nbsm-foo"},
@@ -226,6 +243,8 @@ class TestUpdate(TestCase):
 
         # -- Check the update summary ------------------------------
         expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
                     {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
                     {"type": "progress", "current": 1, "total": 2, "hint": "Installed: nbsm-foo-3-1.nb5.0.noarch"},
                     {"type": "progress", "current": 2, "total": 2, "hint": "Removed: nbsm-foo"},
@@ -245,3 +264,116 @@ class TestUpdate(TestCase):
         # -- Check that the posttrans trigger was run --------------
         self.assertTrue(os.path.exists("/tmp/trigger_was_run"))
         os.unlink("/tmp/trigger_was_run")
+
+    def test_reboot_suggested(self):
+        """Update from a repo with an update suggesting a reboot."""
+        args = [self.command]
+
+        # -- Check the update summary ------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Installed: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Removed: foo"},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Verified: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Verified: foo-1-1.nb5.0.noarch"},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}],
+                     "reboot_suggested": ["NBSA-2014:0042"]},
+                    {"type": "log", "info": "This update requires a reboot"}]
+        self._run_nbyum_test(args, expected)
+
+        # -- Check the installed packages after the update ---------
+        expected = ["0:bar-1-1.nb5.0.noarch",
+                    "0:foo-1-2.nb5.0.noarch",
+                    "0:nbsm-foo-1-1.nb5.0.noarch",
+                    "0:toto-1-1.nb5.0.noarch"]
+        self._check_installed_rpms(expected)
+
+    def test_download_only(self):
+        """Download the updates, without applying them."""
+        args = [self.command, "--download-only"]
+
+        # -- Check the update summary ------------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "log", "info": "Downloaded 1 package, ready to be installed."},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
+        self._run_nbyum_test(args, expected)
+
+        # -- Check the installed packages were left alone ----------
+        expected = ["0:bar-1-1.nb5.0.noarch",
+                    "0:foo-1-1.nb5.0.noarch",
+                    "0:nbsm-foo-1-1.nb5.0.noarch",
+                    "0:toto-1-1.nb5.0.noarch"]
+        self._check_installed_rpms(expected)
+
+    def test_timings(self):
+        """Update, printing how long each stage took."""
+        args = ["--timings", self.command]
+
+        result = self._run_nbyum(args)
+        metrics = [obj for obj in result if obj["type"] == "metrics"]
+
+        # -- Check the stages were measured, in order --------------
+        expected = ["metadata", "updateinfo", "prepare", "depsolve",
+                    "download", "verify", "transaction", "recap"]
+        self.assertEqual([obj["stage"] for obj in metrics], expected)
+
+        for obj in metrics:
+            self.assertEqual(sorted(obj), ["cpu", "maxrss", "stage", "type",
+                                           "wall"])
+
+        # -- Check the rest of the output is untouched -------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Installed: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Removed: foo"},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Verified: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Verified: foo-1-1.nb5.0.noarch"},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
+        self.assertEqual([obj for obj in result if obj["type"] != "metrics"],
+                         expected)
+
+    def test_trace(self):
+        """Update, recording a trace of what happened."""
+        tracepath = os.path.join(self.dataroot,
+                                 "%s.trace" % self._testMethodName)
+        args = ["--trace", tracepath, self.command]
+
+        # -- Check the output is untouched -------------------------
+        expected = [{"type": "progress", "current": 0, "total": 1, "hint": "Downloading the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Fetched the metadata of setup"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Fetched the metadata of test"},
+                    {"type": "progress", "current": 0, "total": 1, "hint": "Processing the package metadata..."},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Installed: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Removed: foo"},
+                    {"type": "progress", "current": 1, "total": 2, "hint": "Verified: foo-1-2.nb5.0.noarch"},
+                    {"type": "progress", "current": 2, "total": 2, "hint": "Verified: foo-1-1.nb5.0.noarch"},
+                    {"type": "recap",
+                     "update": [{"name": "foo", "old": "1-1.nb5.0", "new": "1-2.nb5.0"}]}]
+        self._run_nbyum_test(args, expected)
+
+        # -- Check the trace ---------------------------------------
+        try:
+            with open(tracepath) as f:
+                trace = json.load(f)
+
+        finally:
+            os.unlink(tracepath)
+
+        names = set([event["name"] for event in trace["traceEvents"]])
+
+        for name in ("run", "lock", "unlock", "prepare", "depsolve",
+                     "transaction", "Verify foo-1-2.nb5.0.noarch", "recap"):
+            self.assertTrue(name in names, msg="Missing span: %s" % name)
+
+        for event in trace["traceEvents"]:
+            self.assertEqual(event["ph"], "X")